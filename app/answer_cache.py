@@ -0,0 +1,93 @@
+import os
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from app.models import CachedAnswer, CorpusVersion
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True") == "True"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def get_corpus_version(session: Session) -> int:
+    row = session.get(CorpusVersion, 1)
+    return row.version if row else 0
+
+
+def bump_corpus_version(session: Session) -> int:
+    """Invalidate every cached answer. Runs in the caller's transaction."""
+    stmt = (
+        insert(CorpusVersion)
+        .values(id=1, version=1)
+        .on_conflict_do_update(
+            index_elements=[CorpusVersion.id],
+            set_={"version": CorpusVersion.version + 1},
+        )
+        .returning(CorpusVersion.version)
+    )
+    version = session.exec(stmt).scalar_one()
+    session.exec(delete(CachedAnswer).where(CachedAnswer.corpus_version < version))
+    return version
+
+
+def find_cached_answer(
+    session: Session,
+    embedding: list[float],
+    corpus_version: int,
+    owner: str = "",
+    retrieval: str = "",
+) -> CachedAnswer | None:
+    """Find an answer to a similar question, retrieved with the same parameters.
+
+    Answers built from context fetched in another mode, with another top_k or
+    max_distance, are not reused.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+
+    distance = CachedAnswer.embedding.op("<=>")(embedding)
+    stmt = (
+        select(CachedAnswer)
+        .where(CachedAnswer.corpus_version == corpus_version)
+        .where(CachedAnswer.owner == owner)
+        .where(CachedAnswer.retrieval == retrieval)
+        .where(distance <= 1 - ANSWER_CACHE_SIMILARITY)
+        .order_by(distance)
+        .limit(1)
+    )
+    return session.exec(stmt).first()
+
+
+def cache_answer(
+    session: Session,
+    query_text: str,
+    embedding: list[float],
+    answer: str,
+    context: list[str],
+    corpus_version: int,
+    sources: list[dict] | None = None,
+    owner: str = "",
+    retrieval: str = "",
+):
+    """Store an answer computed against `corpus_version`.
+
+    The version is read before retrieval, so an answer that raced with an
+    upload is stored under the old version and is never served.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return
+
+    session.add(
+        CachedAnswer(
+            corpus_version=corpus_version,
+            query_text=query_text,
+            embedding=embedding,
+            answer=answer,
+            context=context,
+            sources=sources or [],
+            owner=owner,
+            retrieval=retrieval,
+        )
+    )
+    session.commit()
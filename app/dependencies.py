@@ -1,3 +1,6 @@
+import os
+import uuid
+
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -5,11 +8,20 @@ from jwt.exceptions import InvalidTokenError
 from sqlmodel import Session
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.helpers import ALGORITHM, SECRET_KEY, get_user_by_username
+from app.helpers import ALGORITHM, SECRET_KEY, LRUCache, get_user_by_username
 from app.models import Role, User, async_engine, engine
 
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+# Trust the user id and role in a valid token for endpoints that only need the
+# caller's identity. Deleted users keep access until their token expires.
+AUTH_CLAIMS_ONLY = os.getenv("AUTH_CLAIMS_ONLY", "False") == "True"
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token/")
 
+# Detached copies of user rows, keyed by username.
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
 
 def get_session():
     with Session(engine) as session:
@@ -21,9 +33,12 @@ async def get_async_session():
         yield session
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)
-):
+def forget_user(username: str):
+    """Drop a cached user row after it was changed or deleted."""
+    user_cache.delete_where(lambda key: key == username)
+
+
+def decode_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -31,18 +46,58 @@ def get_current_user(
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-
     except InvalidTokenError:
         raise credentials_exception
 
-    user = get_user_by_username(db, username)
-    if user is None:
+    if payload.get("sub") is None:
         raise credentials_exception
+    return payload
+
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)
+):
+    payload = decode_token(token)
+    username: str = payload["sub"]
+
+    # The session only checks out a connection on a cache miss.
+    user = user_cache.get(username)
+    if user is None:
+        user = get_user_by_username(db, username)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user = User.model_validate(user)
+        user_cache.set(username, user)
+
+    # Callers get their own detached copy to modify. Validating from the
+    # attributes keeps excluded fields such as role, which model_dump drops.
+    return User.model_validate(user)
 
-    return user
+
+def get_current_identity(
+    token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)
+):
+    """The caller as a User carrying only id, username and role.
+
+    With AUTH_CLAIMS_ONLY it is built from the token without touching the
+    database, for endpoints that only need to know who is calling. Tokens
+    without a user id claim go through get_current_user.
+    """
+    payload = decode_token(token)
+    if not AUTH_CLAIMS_ONLY or "uid" not in payload:
+        return get_current_user(token, db)
+
+    return User(
+        id=uuid.UUID(payload["uid"]),
+        username=payload["sub"],
+        email="",
+        password="",
+        role=payload.get("role"),
+    )
 
 
 def get_current_admin(current_user: User = Depends(get_current_user)):
@@ -0,0 +1,142 @@
+import os
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MAX_LENGTH = 256
+# Identifies the vectors produced by the configured backend, e.g. in caches.
+EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}"
+
+
+def load_tokenizer(model_name: str = EMBEDDING_MODEL_NAME):
+    """Load the model's fast tokenizer without loading the model itself."""
+    from huggingface_hub import hf_hub_download
+    from tokenizers import Tokenizer
+
+    repo_id = f"sentence-transformers/{model_name}"
+    return Tokenizer.from_file(hf_hub_download(repo_id, "tokenizer.json"))
+
+
+class EmbeddingBackend(Protocol):
+    """Turns texts into L2-normalized embeddings, one row per text."""
+
+    name: str
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> np.ndarray: ...
+
+
+class TorchBackend:
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        # Imported here so the ONNX backends never pay for loading torch.
+        from sentence_transformers import SentenceTransformer
+
+        self.name = f"{model_name}:torch"
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxBackend:
+    """Runs the exported ONNX graph with ONNX Runtime on the CPU.
+
+    Mean pooling and normalization reproduce the sentence-transformers
+    pipeline of the model, without importing torch.
+    """
+
+    backend_name = "onnx"
+    model_file = "onnx/model.onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+
+        repo_id = f"sentence-transformers/{model_name}"
+        self.name = f"{model_name}:{self.backend_name}"
+
+        self.tokenizer = load_tokenizer(model_name)
+        self.tokenizer.enable_truncation(EMBEDDING_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+        model_path = self.prepare_model(hf_hub_download(repo_id, self.model_file))
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def prepare_model(self, path: str) -> str:
+        return path
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> np.ndarray:
+        batches = [
+            self._encode_batch(texts[i : i + batch_size])  # noqa
+            for i in range(0, len(texts), batch_size)
+        ]
+        return (
+            np.concatenate(batches) if batches else np.empty((0, 384), dtype=np.float32)
+        )
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(
+            None, {k: v for k, v in inputs.items() if k in self.input_names}
+        )[0]
+
+        mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class QuantizedOnnxBackend(OnnxBackend):
+    """ONNX backend with int8 weights from dynamic quantization.
+
+    The quantized graph is produced once next to the downloaded model and
+    reused on later starts.
+    """
+
+    backend_name = "onnx-int8"
+
+    def prepare_model(self, path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized = Path(path).with_name("model_int8_dynamic.onnx")
+        if not quantized.exists():
+            # Several worker processes may start at once: each writes its own
+            # file and renames it into place, so none loads a partial model.
+            temporary = quantized.with_suffix(f".{os.getpid()}.onnx")
+            try:
+                quantize_dynamic(path, temporary, weight_type=QuantType.QInt8)
+                os.replace(temporary, quantized)
+            finally:
+                temporary.unlink(missing_ok=True)
+        return str(quantized)
+
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+    "onnx-int8": QuantizedOnnxBackend,
+}
+
+
+def get_embedding_backend(name: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return backend()
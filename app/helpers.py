@@ -1,19 +1,399 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
 import os
+import queue
+import re
+import threading
+import time
 import uuid
+from collections import Counter, OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import (
+    Future,
+    InvalidStateError,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
 from datetime import UTC, datetime, timedelta
+from functools import partial
+from itertools import islice, repeat
 
 import jwt
-from passlib.context import CryptContext
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from sqlalchemy import Engine, delete, func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlmodel import Session, select
 
-from app.models import User
+from app.embedding_backends import (
+    EMBEDDING_MAX_LENGTH,
+    EMBEDDING_MODEL_ID,
+    EmbeddingBackend,
+    get_embedding_backend,
+    load_tokenizer,
+)
+from app.models import Chunk, ChunkEmbedding, User
+from app.passwords import pwd_context
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
 ALGORITHM = "HS256"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+EMBEDDING_PROCESSES = int(os.getenv("EMBEDDING_PROCESSES", "0"))
+# [CLS] and [SEP] take two of the model's positions.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", EMBEDDING_MAX_LENGTH - 2))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Shorter paragraphs are merged with the following ones into one chunk.
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", CHUNK_MAX_TOKENS // 4))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+CHUNK_EMBEDDING_CACHE = os.getenv("CHUNK_EMBEDDING_CACHE", "True") == "True"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+logger = logging.getLogger(__name__)
+
+embedding_executor = ThreadPoolExecutor(
+    max_workers=EMBEDDING_WORKERS, thread_name_prefix="embedding"
+)
+
+
+_embedding_model: EmbeddingBackend | None = None
+_embedding_model_lock = threading.Lock()
+_chunk_tokenizer = None
+
+
+def get_embedding_model() -> EmbeddingBackend:
+    """Load the embedding backend on first use, once per process."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = get_embedding_backend()
+    return _embedding_model
+
+
+_embedding_process_pool: ProcessPoolExecutor | None = None
+
+
+def _init_embedding_process():
+    get_embedding_model().encode(["warm up"])
+
+
+def _encode_to_buffer(texts: list[str], batch_size: int) -> bytes:
+    embeddings = get_embedding_model().encode(texts, batch_size=batch_size)
+    return np.asarray(embeddings, dtype=np.float32).tobytes()
+
+
+def get_embedding_process_pool() -> ProcessPoolExecutor | None:
+    """Pool of worker processes that each hold a copy of the model.
+
+    Only used when EMBEDDING_PROCESSES > 0; otherwise embeddings are computed
+    in the API process.
+    """
+    global _embedding_process_pool
+    if EMBEDDING_PROCESSES <= 0:
+        return None
+
+    if _embedding_process_pool is None:
+        with _embedding_model_lock:
+            if _embedding_process_pool is None:
+                # Forking a process that already runs threads is unsafe.
+                _embedding_process_pool = ProcessPoolExecutor(
+                    max_workers=EMBEDDING_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_embedding_process,
+                )
+    return _embedding_process_pool
+
+
+def _discard_embedding_process_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next call starts a new one."""
+    global _embedding_process_pool
+    with _embedding_model_lock:
+        if _embedding_process_pool is pool:
+            _embedding_process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_encode(
+    pool: ProcessPoolExecutor, batch: list[str], batch_size: int
+) -> tuple[ProcessPoolExecutor, Future]:
+    try:
+        return pool, pool.submit(_encode_to_buffer, batch, batch_size)
+    except BrokenProcessPool:
+        _discard_embedding_process_pool(pool)
+        pool = get_embedding_process_pool()
+        return pool, pool.submit(_encode_to_buffer, batch, batch_size)
+
+
+def _encoded(
+    pool: ProcessPoolExecutor, batch: list[str], future: Future, batch_size: int
+) -> np.ndarray:
+    """Wait for a batch, encoding it once more in a new pool if a worker died."""
+    try:
+        buffer = future.result()
+    except BrokenProcessPool:
+        _discard_embedding_process_pool(pool)
+        pool = get_embedding_process_pool()
+        buffer = pool.submit(_encode_to_buffer, batch, batch_size).result()
+    return _from_buffer(buffer, len(batch))
+
+
+def shutdown_embedding_process_pool():
+    if _embedding_process_pool is not None:
+        _embedding_process_pool.shutdown(cancel_futures=True)
+
+
+def warm_up_embedding_model():
+    """Load the model and run one inference so the first request is not cold."""
+    # Chunking runs in this process whether or not embedding does.
+    get_chunk_tokenizer()
+    pool = get_embedding_process_pool()
+    if pool is None:
+        get_embedding_model().encode(["warm up"])
+        return
+
+    warm_up = [["warm up"]] * EMBEDDING_PROCESSES
+    list(pool.map(_encode_to_buffer, warm_up, repeat(1)))
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _from_buffer(buffer: bytes, rows: int) -> np.ndarray:
+    return np.frombuffer(buffer, dtype=np.float32).reshape(rows, -1)
+
+
+def encode_batches(
+    batches: Iterable[list[str]], batch_size: int = EMBEDDING_BATCH_SIZE
+) -> Iterator[tuple[list[str], np.ndarray]]:
+    """Encode each batch, yielding `(batch, embeddings)` pairs in order.
+
+    Batches are pulled lazily. With a process pool a few batches per worker
+    are encoded in parallel across cores and come back as raw float32
+    buffers rather than pickled Python lists.
+    """
+    pool = get_embedding_process_pool()
+    if pool is None:
+        for batch in batches:
+            embeddings = get_embedding_model().encode(batch, batch_size=batch_size)
+            yield batch, np.asarray(embeddings)
+        return
+
+    # A worker that dies (e.g. killed for memory) breaks the whole pool; it is
+    # then replaced and the batches in flight are encoded once more.
+    pending: deque = deque()
+    for batch in batches:
+        pool, future = _submit_encode(get_embedding_process_pool(), batch, batch_size)
+        pending.append((pool, batch, future))
+        if len(pending) >= 2 * EMBEDDING_PROCESSES:
+            pool, batch, future = pending.popleft()
+            yield batch, _encoded(pool, batch, future, batch_size)
+
+    while pending:
+        pool, batch, future = pending.popleft()
+        yield batch, _encoded(pool, batch, future, batch_size)
+
+
+def encode_texts(texts: list[str], batch_size: int = EMBEDDING_BATCH_SIZE):
+    batches = iter_batches(texts, batch_size)
+    return np.concatenate([e for _, e in encode_batches(batches, batch_size)])
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a size bound and a per-entry TTL.
+
+    A `maxsize` of 0 disables the cache: every lookup is a miss and nothing
+    is stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_where(self, predicate: Callable[[object], bool]) -> int:
+        """Drop every entry whose key matches `predicate`."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent single-text embedding requests into batches.
+
+    Requests arriving within `max_wait_ms` of the first queued one, up to
+    `max_size` of them, are encoded with a single call and the results are
+    handed back to each caller. A `max_size` of 1 encodes every request
+    directly in the calling thread.
+    """
+
+    def __init__(self, encode: Callable, max_size: int, max_wait_ms: float):
+        self.encode = encode
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+
+    def embed(self, text: str) -> list[float]:
+        if self.max_size <= 1:
+            self._record(1)
+            return self.encode([text])[0]
+
+        return self.submit(text).result()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for the next batch and return its future right away."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _take(self, timeout: float | None = None) -> tuple[str, Future] | None:
+        """Next queued request, or None when it was cancelled while waiting."""
+        text, future = self._queue.get(timeout=timeout)
+        # Marks the future running, so the caller can no longer cancel it.
+        if not future.set_running_or_notify_cancel():
+            return None
+        return text, future
+
+    def _run(self):
+        while True:
+            try:
+                self._run_batch()
+            except Exception:
+                # One bad batch must not take the worker, and every later
+                # request, down with it.
+                logger.exception("Embedding batch failed")
+
+    def _run_batch(self):
+        item = self._take()
+        batch = [item] if item else []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._take(timeout)
+            except queue.Empty:
+                break
+            if item:
+                batch.append(item)
+        if not batch:
+            return
+
+        # Identical questions in one batch are encoded once.
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = dict(zip(texts, self.encode(texts)))
+        except Exception as e:
+            for _, future in batch:
+                _resolve(future.set_exception, e)
+            return
+
+        self._record(len(batch))
+        for text, future in batch:
+            _resolve(future.set_result, embeddings[text])
+
+    def _record(self, size: int):
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.max_batch_size = max(self.max_batch_size, size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "queued": self._queue.qsize(),
+            }
+
+
+def _resolve(set_outcome: Callable, value):
+    try:
+        set_outcome(value)
+    except InvalidStateError:
+        pass
+
+
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: encode_texts(texts).tolist(),
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_BATCH_MAX_WAIT_MS,
+)
 
 
 def get_user_by_username(session: Session, username: str):
@@ -44,12 +424,480 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 def create_embedding(text: str) -> list[float]:
-    return embedding_model.encode(text).tolist()
+    text = " ".join(text.split())
+    key = (EMBEDDING_MODEL_ID, text)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        embedding = tuple(embedding_batcher.embed(text))
+        embedding_cache.set(key, embedding)
+    return list(embedding)
+
+
+async def create_embedding_async(text: str) -> list[float]:
+    """Like create_embedding, but awaits the batch instead of holding a thread.
+
+    The embedding executor is not involved, so the number of queries in
+    flight (and the size of a micro-batch) is not limited by its workers.
+    """
+    text = " ".join(text.split())
+    key = (EMBEDDING_MODEL_ID, text)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        future = embedding_batcher.submit(text)
+        embedding = tuple(await asyncio.wrap_future(future))
+        embedding_cache.set(key, embedding)
+    return list(embedding)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
 
 
-def chunk_text(text: str, chunk_size: int = 256) -> list[str]:
-    words = text.split()
+def get_cached_embeddings(session: Session, hashes: Iterable[str]) -> dict:
+    """Fetch the stored embeddings of these chunk hashes with one query."""
+    hashes = set(hashes)
+    if not CHUNK_EMBEDDING_CACHE or not hashes:
+        return {}
+
+    stmt = select(ChunkEmbedding.content_hash, ChunkEmbedding.embedding).where(
+        ChunkEmbedding.model == EMBEDDING_MODEL_ID,
+        ChunkEmbedding.content_hash.in_(hashes),
+    )
+    return dict(session.exec(stmt).all())
+
+
+def _chunk_rows(
+    document_id: uuid.UUID,
+    owner: str,
+    chunks: list[str],
+    hashes: list[str],
+    embeddings: list,
+) -> list[dict]:
     return [
-        " ".join(words[i : i + chunk_size])  # noqa
-        for i in range(0, len(words), chunk_size)
+        {
+            "id": uuid.uuid4(),
+            "document_id": document_id,
+            "owner": owner,
+            "chunk_text": chunk,
+            "content_hash": digest,
+            "embedding": embedding,
+        }
+        for chunk, digest, embedding in zip(chunks, hashes, embeddings)
     ]
+
+
+def embed_chunk_rows(
+    document_id: uuid.UUID, owner: str, chunks: list[str], cached: dict | None = None
+) -> list[dict]:
+    """Embed one batch of chunks into rows ready for a bulk INSERT."""
+    batches = iter_chunk_rows(document_id, owner, chunks, len(chunks), cached)
+    rows, _ = next(batches, ([], {}))
+    return rows
+
+
+def iter_chunk_rows(
+    document_id: uuid.UUID,
+    owner: str,
+    chunks: Iterable[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    cached: dict | None = None,
+    lookup: Callable[[list[str]], dict] | None = None,
+) -> Iterator[tuple[list[dict], dict]]:
+    """Embed chunks batch by batch, yielding rows ready for a bulk INSERT.
+
+    Chunks whose hash is in `cached` (see `get_cached_embeddings`), or found
+    by `lookup` for their batch, reuse that embedding, and repeated chunks
+    within a batch are embedded once. Each batch of rows comes with the
+    cached embeddings it used. Only one batch is alive at a time, however
+    long `chunks` is.
+    """
+    cached = cached or {}
+    # (chunks, hashes, cache hits, hashes to embed) of batches pulled by
+    # encode_batches.
+    pending: deque = deque()
+
+    def misses() -> Iterator[list[str]]:
+        for batch in iter_batches(chunks, batch_size):
+            hashes = [content_hash(chunk) for chunk in batch]
+            hits = lookup(hashes) if lookup else {}
+            hits.update((h, cached[h]) for h in hashes if h in cached)
+            texts = {h: c for c, h in zip(batch, hashes) if h not in hits}
+            pending.append((batch, hashes, hits, list(texts)))
+            if texts:
+                yield list(texts.values())
+
+    def rows(embedded: dict) -> tuple[list[dict], dict]:
+        batch, hashes, hits, _ = pending.popleft()
+        embeddings = [embedded.get(h, hits.get(h)) for h in hashes]
+        return _chunk_rows(document_id, owner, batch, hashes, embeddings), hits
+
+    for _, embeddings in encode_batches(misses(), batch_size):
+        while not pending[0][3]:
+            yield rows({})
+        yield rows(dict(zip(pending[0][3], embeddings.tolist())))
+
+    while pending:
+        yield rows({})
+
+
+def insert_chunk_rows(
+    session: Session, rows: list[dict], cached: dict | None = None
+) -> int:
+    """Write chunk rows with one multi-row INSERT. Nothing is committed here.
+
+    Embeddings that were not taken from `cached` are added to the chunk
+    embedding cache, see `cache_chunk_embeddings`.
+    """
+    if not rows:
+        return 0
+
+    session.exec(insert(Chunk), params=rows)
+    if CHUNK_EMBEDDING_CACHE:
+        cached = cached or {}
+        cache_chunk_embeddings(
+            session.get_bind(),
+            {
+                row["content_hash"]: row["embedding"]
+                for row in rows
+                if row["content_hash"] not in cached
+            },
+        )
+    return len(rows)
+
+
+def cache_chunk_embeddings(bind: Engine, embeddings: dict):
+    """Add embeddings to the chunk embedding cache in their own transaction.
+
+    Committing right away keeps uploads that share chunks from waiting on each
+    other's ingestion transaction, and writing in hash order keeps them from
+    deadlocking. An entry outlives a rolled back upload, which is harmless as
+    it is keyed by content.
+    """
+    if not embeddings:
+        return
+
+    stmt = pg_insert(ChunkEmbedding).on_conflict_do_nothing()
+    with Session(bind) as session:
+        session.exec(
+            stmt,
+            params=[
+                {"content_hash": h, "model": EMBEDDING_MODEL_ID, "embedding": e}
+                for h, e in sorted(embeddings.items())
+            ],
+        )
+        session.commit()
+
+
+def count_cache_hits(chunks: Iterable[str], cached: dict) -> int:
+    return sum(1 for chunk in chunks if content_hash(chunk) in cached)
+
+
+def insert_chunks(
+    session: Session,
+    document_id: uuid.UUID,
+    owner: str,
+    chunks: Iterable[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    on_progress: Callable[[int], None] | None = None,
+) -> dict:
+    """Embed `chunks` and write them with one multi-row INSERT per batch.
+
+    `chunks` is consumed lazily. The chunk embedding cache is queried once per
+    batch and only the misses are embedded. Returns the number of chunks and
+    cache hits.
+
+    `on_progress` is called with the number of chunks written so far after
+    every batch. The caller owns the transaction; nothing is committed here.
+    """
+    lookup = partial(get_cached_embeddings, session)
+    total = cache_hits = 0
+    batches = iter_chunk_rows(document_id, owner, chunks, batch_size, lookup=lookup)
+    for rows, hits in batches:
+        total += insert_chunk_rows(session, rows, hits)
+        cache_hits += sum(row["content_hash"] in hits for row in rows)
+        if on_progress:
+            on_progress(total)
+    return ingestion_stats(total, cache_hits)
+
+
+def update_chunks(
+    session: Session, document_id: uuid.UUID, owner: str, chunks: list[str]
+) -> dict:
+    """Make the document's chunks match `chunks`, touching only the difference.
+
+    Stored and new chunks are matched by content hash, counting repeats.
+    Unmatched stored chunks are deleted and unmatched new ones are embedded
+    and inserted. The caller owns the transaction; nothing is committed here.
+    """
+    stored_hash = func.coalesce(
+        Chunk.content_hash,
+        func.encode(func.sha256(func.convert_to(Chunk.chunk_text, "UTF8")), "hex"),
+    )
+    stored = session.exec(
+        select(Chunk.id, stored_hash).where(Chunk.document_id == document_id)
+    ).all()
+
+    wanted = Counter(content_hash(chunk) for chunk in chunks)
+    removed = []
+    for chunk_id, digest in stored:
+        if wanted[digest] > 0:
+            wanted[digest] -= 1
+        else:
+            removed.append(chunk_id)
+
+    added = []
+    for chunk in chunks:
+        digest = content_hash(chunk)
+        if wanted[digest] > 0:
+            wanted[digest] -= 1
+            added.append(chunk)
+
+    if removed:
+        session.exec(delete(Chunk).where(Chunk.id.in_(removed)))
+    stats = insert_chunks(session, document_id, owner, added)
+    return {
+        "chunks": len(chunks),
+        "unchanged": len(chunks) - len(added),
+        "added": len(added),
+        "removed": len(removed),
+        "cache_hits": stats["cache_hits"],
+    }
+
+
+def ingestion_stats(chunks: int, cache_hits: int) -> dict:
+    return {
+        "chunks": chunks,
+        "cache_hits": cache_hits,
+        "cache_hit_ratio": cache_hits / chunks if chunks else 0.0,
+    }
+
+
+async def run_in_embedding_executor(func: Callable, *args):
+    """Run CPU-bound embedding work off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(embedding_executor, func, *args)
+
+
+def get_chunk_tokenizer():
+    global _chunk_tokenizer
+    if _chunk_tokenizer is None:
+        with _embedding_model_lock:
+            if _chunk_tokenizer is None:
+                tokenizer = load_tokenizer()
+                # Counts must cover whole words, however long.
+                tokenizer.no_truncation()
+                tokenizer.no_padding()
+                _chunk_tokenizer = tokenizer
+    return _chunk_tokenizer
+
+
+def split_long_word(word: str, max_tokens: int) -> list[tuple[str, int]]:
+    """Cut a word of more than `max_tokens` tokens into pieces that fit.
+
+    Cuts fall on token boundaries, taken from the tokenizer's offsets. Text
+    without whitespace (CJK, base64, minified JSON) is one long word.
+    """
+    offsets = get_chunk_tokenizer().encode(word, add_special_tokens=False).offsets
+    if len(offsets) <= max_tokens:
+        return [(word, len(offsets))]
+
+    cuts = [offsets[i][0] for i in range(max_tokens, len(offsets), max_tokens)]
+    bounds = [0, *(cut for cut in cuts if 0 < cut < len(word)), len(word)]
+    pieces = [word[a:b] for a, b in zip(bounds, bounds[1:]) if b > a]
+    if len(pieces) == 1:
+        return [(word, len(offsets))]
+
+    # A piece can tokenize slightly differently on its own, so check again.
+    return [split for piece in pieces for split in split_long_word(piece, max_tokens)]
+
+
+def iter_word_tokens(
+    text: str, max_tokens: int = CHUNK_MAX_TOKENS, window: int = 1024
+) -> Iterator[tuple[str, int]]:
+    """Walk the words of `text`, yielding each with its embedding token count.
+
+    Words are tokenized `window` at a time, so the text is never split or
+    copied as a whole. Words longer than `max_tokens` are split into pieces.
+    """
+    tokenizer = get_chunk_tokenizer()
+    words = (match.group() for match in re.finditer(r"\S+", text))
+    for batch in iter_batches(words, window):
+        encoding = tokenizer.encode(
+            batch, is_pretokenized=True, add_special_tokens=False
+        )
+        counts = [0] * len(batch)
+        for word_id in encoding.word_ids:
+            if word_id is not None:
+                counts[word_id] += 1
+        for word, count in zip(batch, counts):
+            if count > max_tokens:
+                yield from split_long_word(word, max_tokens)
+            else:
+                yield word, count
+
+
+def split_trailing_word(text: str) -> tuple[str, str]:
+    """Split `text` before its last word, which may continue in the next piece.
+
+    Scans back from the end, so the cost is the length of that word only.
+    """
+    start = len(text)
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    return text[:start], text[start:]
+
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+class Chunker:
+    """Incremental form of `iter_chunks` for text that arrives in pieces.
+
+    A word split across two pieces is held back until its end is seen, so
+    feeding pieces gives the same chunks as feeding the whole text at once.
+    A word still unfinished after `max_partial_chars` is cut into pieces
+    right away, so text without whitespace is never held as a whole.
+
+    Chunks end at paragraph breaks (blank lines) chosen by content: once a
+    chunk holds `min_tokens`, it ends after a paragraph whose hash selects it
+    as a boundary, or after any paragraph once it holds half the budget.
+    Short paragraphs are merged, and an edit only moves the boundaries up to
+    the next one chosen the same way, leaving the other chunks as they were.
+    """
+
+    max_partial_chars = 16 * 1024
+    # About one paragraph break in this many is a content-defined boundary.
+    boundary_every = 4
+
+    def __init__(
+        self,
+        max_tokens: int = CHUNK_MAX_TOKENS,
+        overlap: int = CHUNK_OVERLAP_TOKENS,
+        min_tokens: int = CHUNK_MIN_TOKENS,
+    ):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.min_tokens = min_tokens
+        self._partial = ""
+        self._chunk: deque[tuple[str, int]] = deque()
+        self._tokens = 0
+        # Hash of the words of the current paragraph, and how many there are.
+        self._paragraph = hashlib.sha256()
+        self._paragraph_words = 0
+        # Whether the text so far ends with a newline and whitespace, so a
+        # newline at the start of the next piece completes a paragraph break.
+        self._line_start = False
+
+    def feed(self, text: str) -> list[str]:
+        """Add a piece of text and return the chunks it completed."""
+        text, self._partial = split_trailing_word(self._partial + text)
+        chunks = self._add_text(text)
+        if len(self._partial) > self.max_partial_chars:
+            pieces = split_long_word(self._partial, self.max_tokens)
+            # The last piece may still continue in the next piece of text.
+            if len(pieces) > 1:
+                self._partial = pieces.pop()[0]
+            else:
+                self._partial = ""
+            chunks += self._add_words(pieces)
+            self._line_start = False
+        return chunks
+
+    def close(self) -> list[str]:
+        """Return the remaining chunks once all text has been fed."""
+        chunks = self._add_text(self._partial)
+        self._partial = ""
+        self._line_start = False
+        return chunks + self._flush()
+
+    def _add_text(self, text: str) -> list[str]:
+        if not text:
+            return []
+
+        chunks = []
+        stripped = text.lstrip()
+        if self._line_start and "\n" in text[: len(text) - len(stripped)]:
+            chunks += self._end_paragraph()
+
+        for i, paragraph in enumerate(PARAGRAPH_BREAK.split(text)):
+            if i:
+                chunks += self._end_paragraph()
+            chunks += self._add_words(iter_word_tokens(paragraph, self.max_tokens))
+
+        trailing = text[len(text.rstrip()) :]  # noqa
+        if stripped:
+            self._line_start = "\n" in trailing
+        else:
+            self._line_start = self._line_start or "\n" in trailing
+        return chunks
+
+    def _end_paragraph(self) -> list[str]:
+        """End the chunk after this paragraph if it is a boundary."""
+        if not self._paragraph_words:
+            return []
+
+        boundary = self._paragraph.digest()[0] % self.boundary_every == 0
+        self._paragraph = hashlib.sha256()
+        self._paragraph_words = 0
+        if self._tokens >= self.min_tokens and (
+            boundary or 2 * self._tokens >= self.max_tokens
+        ):
+            return self._flush()
+        return []
+
+    def _flush(self) -> list[str]:
+        """End the current chunk without carrying an overlap into the next."""
+        if not self._chunk:
+            return []
+        chunk = " ".join(w for w, _ in self._chunk)
+        self._chunk.clear()
+        self._tokens = 0
+        return [chunk]
+
+    def _add_words(self, words: Iterable[tuple[str, int]]) -> list[str]:
+        chunks = []
+        for word, count in words:
+            self._paragraph.update(word.encode() + b" ")
+            self._paragraph_words += 1
+            if self._chunk and self._tokens + count > self.max_tokens:
+                chunks.append(" ".join(w for w, _ in self._chunk))
+
+                tail: deque[tuple[str, int]] = deque()
+                kept = 0
+                while self._chunk and kept + self._chunk[-1][1] <= self.overlap:
+                    kept += self._chunk[-1][1]
+                    tail.appendleft(self._chunk.pop())
+                self._chunk, self._tokens = tail, kept
+                while self._chunk and self._tokens + count > self.max_tokens:
+                    self._tokens -= self._chunk.popleft()[1]
+
+            self._chunk.append((word, count))
+            self._tokens += count
+        return chunks
+
+
+def iter_chunks(
+    text: str | Iterable[str],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
+    """Yield chunks of at most `max_tokens` embedding tokens.
+
+    `text` is a string or an iterable of string pieces. Chunks end at
+    paragraph breaks chosen by content (see `Chunker`), so short paragraphs
+    are merged, and consecutive chunks within a paragraph share up to
+    `overlap` tokens of whole words. A word longer than `max_tokens` is split
+    into pieces of at most `max_tokens` tokens.
+    """
+    chunker = Chunker(max_tokens, overlap)
+    for piece in [text] if isinstance(text, str) else text:
+        yield from chunker.feed(piece)
+    yield from chunker.close()
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> list[str]:
+    return list(iter_chunks(text, max_tokens, overlap))
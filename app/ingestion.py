@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Engine, update
+from sqlmodel import Session
+
+from app.answer_cache import bump_corpus_version
+from app.helpers import insert_chunks, iter_chunks
+from app.models import Document, IngestionJob, JobStatus
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_PENDING = int(os.getenv("INGESTION_MAX_PENDING", "100"))
+# Fail jobs left pending or running by a previous process on startup. Only
+# safe with a single API instance: with several on the same database (or during
+# a rolling deploy) a starting one would fail the live jobs of the others.
+INGESTION_FAIL_INTERRUPTED_JOBS = (
+    os.getenv("INGESTION_FAIL_INTERRUPTED_JOBS", "False") == "True"
+)
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion"
+)
+_slots = threading.BoundedSemaphore(INGESTION_MAX_PENDING)
+# Jobs submitted by this process that have not finished yet.
+_unfinished: set[uuid.UUID] = set()
+
+
+def _update_job(bind: Engine, job_id: uuid.UUID, **values):
+    with Session(bind) as session:
+        session.exec(
+            update(IngestionJob).where(IngestionJob.id == job_id).values(**values)
+        )
+        session.commit()
+
+
+def run_ingestion_job(bind: Engine, job_id: uuid.UUID, document_id: uuid.UUID):
+    """Embed and persist a document's chunks, reporting progress on the job.
+
+    Progress is written in its own short transactions so it is visible while
+    the chunks themselves are committed atomically at the end.
+    """
+    try:
+        with Session(bind) as session:
+            document = session.get(Document, document_id)
+            # Tokenizing is cheap next to embedding, so count the chunks up
+            # front to report progress against a known total.
+            _update_job(
+                bind,
+                job_id,
+                status=JobStatus.RUNNING,
+                chunks_total=sum(1 for _ in iter_chunks(document.text)),
+                started_at=datetime.now(UTC),
+            )
+
+            stats = insert_chunks(
+                session,
+                document_id,
+                document.owner,
+                iter_chunks(document.text),
+                on_progress=lambda done: _update_job(bind, job_id, chunks_done=done),
+            )
+            bump_corpus_version(session)
+            session.commit()
+
+        _update_job(
+            bind,
+            job_id,
+            status=JobStatus.DONE,
+            cache_hits=stats["cache_hits"],
+            finished_at=datetime.now(UTC),
+        )
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        _update_job(
+            bind,
+            job_id,
+            status=JobStatus.FAILED,
+            error=str(e),
+            finished_at=datetime.now(UTC),
+        )
+    finally:
+        _unfinished.discard(job_id)
+        _slots.release()
+
+
+def submit_ingestion_job(session: Session, document: Document) -> IngestionJob:
+    """Store the document and queue its ingestion on the worker pool.
+
+    Raises 429 once INGESTION_MAX_PENDING jobs are queued or running.
+    """
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many ingestion jobs in progress",
+        )
+
+    try:
+        job = IngestionJob(document_id=document.id)
+        session.add(document)
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        _unfinished.add(job.id)
+        executor.submit(run_ingestion_job, session.get_bind(), job.id, document.id)
+    except Exception:
+        _slots.release()
+        raise
+
+    return job
+
+
+def fail_unfinished_jobs(
+    bind: Engine, error: str, job_ids: set[uuid.UUID] | None = None
+) -> int:
+    """Mark pending or running jobs as failed, so pollers see a final state.
+
+    Without `job_ids`, every unfinished job in the database is failed.
+    """
+    stmt = update(IngestionJob).where(
+        IngestionJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING])
+    )
+    if job_ids is not None:
+        if not job_ids:
+            return 0
+        stmt = stmt.where(IngestionJob.id.in_(job_ids))
+
+    with Session(bind) as session:
+        result = session.exec(
+            stmt.values(
+                status=JobStatus.FAILED, error=error, finished_at=datetime.now(UTC)
+            )
+        )
+        session.commit()
+    return result.rowcount
+
+
+def fail_interrupted_jobs(bind: Engine):
+    """Fail the jobs a previous process left behind when it stopped."""
+    if INGESTION_FAIL_INTERRUPTED_JOBS:
+        failed = fail_unfinished_jobs(bind, "Interrupted by a server restart")
+        if failed:
+            logger.warning("Marked %d interrupted ingestion jobs as failed", failed)
+
+
+def shutdown_ingestion(bind: Engine):
+    """Finish running jobs and fail the queued ones that will never run."""
+    executor.shutdown(cancel_futures=True)
+    fail_unfinished_jobs(bind, "Cancelled by server shutdown", set(_unfinished))
@@ -1,8 +1,62 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+
+from app import ingestion, passwords
+from app.helpers import (
+    embedding_executor,
+    shutdown_embedding_process_pool,
+    warm_up_embedding_model,
+)
+from app.models import (
+    async_engine,
+    engine,
+    init_db,
+    warm_up_async_engine,
+    warm_up_engine,
+)
+from app.routers import auth, health, metrics, rag, users
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up(app: FastAPI):
+    try:
+        await run_in_threadpool(warm_up_embedding_model)
+        await run_in_threadpool(warm_up_engine)
+        await warm_up_async_engine()
+    except Exception:
+        logger.exception("Warm-up failed, the service stays not ready")
+        return
+
+    app.state.ready = True
+
 
-from app.routers import auth, rag, users
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(init_db)
+    await run_in_threadpool(ingestion.fail_interrupted_jobs, engine)
 
-app = FastAPI()
+    # Warm up in the background so liveness probes pass while the model
+    # loads; readiness only turns green once everything is hot.
+    warm_up_task = asyncio.create_task(warm_up(app))
+    yield
+    warm_up_task.cancel()
+
+    app.state.ready = False
+    await run_in_threadpool(ingestion.shutdown_ingestion, engine)
+    embedding_executor.shutdown(cancel_futures=True)
+    shutdown_embedding_process_pool()
+    passwords.shutdown_hashing_executor()
+    await async_engine.dispose()
+    engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
 app.include_router(
     users.router,
@@ -21,3 +75,15 @@ app.include_router(
     prefix="/rag",
     tags=["rag"],
 )
+
+app.include_router(
+    metrics.router,
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+app.include_router(
+    health.router,
+    prefix="/health",
+    tags=["health"],
+)
@@ -1,30 +1,60 @@
 import os
 import uuid
+from datetime import UTC, datetime
 from enum import Enum
 from typing import Any
 
-from pgvector.sqlalchemy import Vector
-from psycopg2 import connect
-from sqlalchemy.ext.asyncio import create_async_engine
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy import JSON, Column, Computed, Engine, Index, cast, func, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import Field, SQLModel, create_engine
 
-USER = os.getenv("POSTGRES_USER")
-PASSWORD = os.getenv("POSTGRES_PASSWORD")
-DB = os.getenv("POSTGRES_DB")
-HOST = os.getenv("POSTGRES_HOST")
-PORT = os.getenv("POSTGRES_PORT")
+from app.pools import timed_pool_class
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 DATABASE_ASYNC_URL = os.getenv("DATABASE_ASYNC_URL")
-
-engine = create_engine(DATABASE_URL, echo=os.getenv("DEBUG") == "True")
-async_engine = create_async_engine(DATABASE_ASYNC_URL, echo=True, future=True)
-
-connection = connect(database=DB, user=USER, password=PASSWORD, host=HOST, port=PORT)
-connection.autocommit = True
-with connection.cursor() as cursor:
-    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
-
-connection.close()
+DEBUG = os.getenv("DEBUG") == "True"
+# Each engine (sync and async) gets its own pool with these settings.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True") == "True"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 0 disables asyncpg's prepared statement cache, e.g. behind pgbouncer.
+ASYNCPG_STATEMENT_CACHE_SIZE = int(os.getenv("ASYNCPG_STATEMENT_CACHE_SIZE", "100"))
+
+VECTOR_INDEX_NAME = "chunk_embedding_idx"
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+# How the ANN index stores vectors: "none" (float32), "halfvec" or "bit".
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "pool_recycle": DB_POOL_RECYCLE,
+}
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=DEBUG,
+    poolclass=timed_pool_class(QueuePool),
+    **POOL_OPTIONS,
+)
+async_engine = create_async_engine(
+    DATABASE_ASYNC_URL,
+    echo=DEBUG,
+    poolclass=timed_pool_class(AsyncAdaptedQueuePool),
+    connect_args={"statement_cache_size": ASYNCPG_STATEMENT_CACHE_SIZE},
+    **POOL_OPTIONS,
+)
 
 
 class Role(str, Enum):
@@ -32,6 +62,13 @@ class Role(str, Enum):
     USER = "user"
 
 
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
 class User(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     username: str = Field(unique=True, index=True)
@@ -44,14 +81,154 @@ class User(SQLModel, table=True):
 
 class Document(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    name: str | None = Field(default=None)
+    # Empty for streamed uploads, which are only kept as chunks.
     text: str = Field()
+    # "User:<id>" or "Organization:<name>"; always set by the server.
+    owner: str = Field(default="", index=True)
+
+
+def default_vector_index_params(index_type: str = VECTOR_INDEX_TYPE):
+    if index_type == "hnsw":
+        return {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    if index_type == "ivfflat":
+        return {"lists": IVFFLAT_LISTS}
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+
+VECTOR_INDEX_OPS = {
+    "none": "vector_cosine_ops",
+    "halfvec": "halfvec_cosine_ops",
+    "bit": "bit_hamming_ops",
+}
+
+
+def quantize(embedding, quantization: str = VECTOR_QUANTIZATION):
+    """Express a vector column or value in the representation of the index."""
+    if quantization == "none":
+        return embedding
+    if quantization == "halfvec":
+        return cast(embedding, HALFVEC(384))
+    if quantization == "bit":
+        return cast(func.binary_quantize(embedding), BIT(384))
+    raise ValueError(f"Unknown vector quantization: {quantization}")
+
+
+def quantized_distance(embedding, query_embedding, quantization=VECTOR_QUANTIZATION):
+    """Distance the ANN index orders by: cosine, or hamming for binary vectors."""
+    embedding = quantize(embedding, quantization)
+    query = quantize(cast(query_embedding, Vector(384)), quantization)
+    if quantization == "bit":
+        return embedding.hamming_distance(query)
+    return embedding.cosine_distance(query)
 
 
 class Chunk(SQLModel, table=True):
+    __table_args__ = (
+        Index("chunk_search_vector_idx", "search_vector", postgresql_using="gin"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    document_id: uuid.UUID = Field(foreign_key="document.id")
+    document_id: uuid.UUID = Field(foreign_key="document.id", index=True)
+    # Copied from the document so searches can be scoped without a join.
+    owner: str = Field(index=True)
     chunk_text: str
+    # sha256 of chunk_text; None for chunks stored before it was recorded.
+    content_hash: str | None = Field(default=None)
+    embedding: Any = Field(sa_type=Vector(384))
+    # Maintained by Postgres from chunk_text; never written by the app.
+    search_vector: Any = Field(
+        default=None,
+        exclude=True,
+        sa_column=Column(
+            TSVECTOR,
+            Computed(
+                f"to_tsvector('{TEXT_SEARCH_CONFIG}', chunk_text)", persisted=True
+            ),
+        ),
+    )
+
+
+# Quantized indexes are built on an expression, so the table keeps the float32
+# vectors that search results are re-ranked with.
+Index(
+    VECTOR_INDEX_NAME,
+    quantize(Chunk.embedding).label("embedding"),
+    postgresql_using=VECTOR_INDEX_TYPE,
+    postgresql_with=default_vector_index_params(),
+    postgresql_ops={"embedding": VECTOR_INDEX_OPS[VECTOR_QUANTIZATION]},
+)
+
+
+class IngestionJob(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    document_id: uuid.UUID = Field(foreign_key="document.id")
+    status: JobStatus = Field(default=JobStatus.PENDING)
+    chunks_total: int = Field(default=0)
+    chunks_done: int = Field(default=0)
+    cache_hits: int = Field(default=0)
+    error: str | None = Field(default=None)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    started_at: datetime | None = Field(default=None)
+    finished_at: datetime | None = Field(default=None)
+
+
+class ChunkEmbedding(SQLModel, table=True):
+    """Embeddings of previously ingested chunk texts, per embedding model."""
+
+    content_hash: str = Field(primary_key=True)
+    model: str = Field(primary_key=True)
     embedding: Any = Field(sa_type=Vector(384))
 
 
-SQLModel.metadata.create_all(engine)
+class CorpusVersion(SQLModel, table=True):
+    """Single-row counter bumped on every change to the document corpus."""
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+
+
+class CachedAnswer(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "cachedanswer_embedding_idx",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    corpus_version: int = Field(index=True)
+    # Answers are only reused for the same user, since context is per user.
+    owner: str = Field(default="", index=True)
+    # Retrieval parameters the context was fetched with; see retrieval_key.
+    retrieval: str = Field(default="")
+    query_text: str
+    embedding: Any = Field(sa_type=Vector(384))
+    answer: str
+    context: list[str] = Field(sa_type=JSON)
+    sources: list[dict] = Field(default_factory=list, sa_type=JSON)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+def init_db(bind: Engine = engine):
+    """Create the pgvector extension and all tables. Safe to run repeatedly."""
+    with bind.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    SQLModel.metadata.create_all(bind)
+
+
+def warm_up_engine(bind: Engine = engine):
+    """Fill the pool with its persistent connections before traffic arrives."""
+    connections = [bind.connect() for _ in range(bind.pool.size())]
+    for connection in connections:
+        connection.execute(text("SELECT 1"))
+        connection.close()
+
+
+async def warm_up_async_engine(bind: AsyncEngine = async_engine):
+    connections = [await bind.connect() for _ in range(bind.pool.size())]
+    for connection in connections:
+        await connection.execute(text("SELECT 1"))
+        await connection.close()
@@ -1,33 +1,99 @@
 import os
+from collections.abc import Callable
 
 from fastapi import HTTPException, status
 from oso_cloud import Oso, Value
 
+from app.helpers import LRUCache
 from app.models import Role, User
 
 api_key = os.getenv("OSO_API_KEY")
 oso_url = os.getenv("OSO_URL")
-oso = Oso(url=oso_url, api_key=api_key)
+OSO_CACHE_SIZE = int(os.getenv("OSO_CACHE_SIZE", "4096"))
+OSO_CACHE_TTL = float(os.getenv("OSO_CACHE_TTL", "30"))
+oso: Oso | None = None
+
+# Decisions keyed by (actor, action, resource). Role changes made through this
+# process invalidate them right away; other processes see them after the TTL.
+decision_cache = LRUCache(OSO_CACHE_SIZE, OSO_CACHE_TTL)
+
+ORGANIZATION = "acme"
+
+
+def get_oso() -> Oso:
+    """Build the Oso client on first use instead of at import time."""
+    global oso
+    if oso is None:
+        oso = Oso(url=oso_url, api_key=api_key)
+    return oso
+
+
+def _actor_key(user: User) -> str:
+    return f"User:{user.id}"
+
+
+def _cached_decision(key: tuple, decide: Callable[[], bool]) -> bool:
+    allowed = decision_cache.get(key)
+    if allowed is None:
+        allowed = decide()
+        decision_cache.set(key, allowed)
+    return allowed
+
+
+def is_allowed(user: User, action: str, resource: Value) -> bool:
+    """Ask Oso whether the user may act on a resource, through the cache."""
+    return _cached_decision(
+        (_actor_key(user), action, f"{resource.type}:{resource.id}"),
+        lambda: get_oso().authorize(Value("User", user.id), action, resource),
+    )
+
+
+def invalidate_oso_decisions(user: User):
+    """Forget every cached decision about the user."""
+    actor = _actor_key(user)
+    decision_cache.delete_where(lambda key: key[0] == actor)
 
 
 def authorize(user: User, action: str, resource: str):
     """Check if the user is allowed to perform an action on a resource."""
-    if not oso.authorize(user.id, action, resource):
+    allowed = _cached_decision(
+        (_actor_key(user), action, resource),
+        lambda: get_oso().authorize(user.id, action, resource),
+    )
+    if not allowed:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
 
 
 def delete_oso_user(user: User):
-    oso.delete(("has_role", Value("User", user.id), None, None))
+    get_oso().delete(("has_role", Value("User", user.id), None, None))
+    invalidate_oso_decisions(user)
 
 
 def add_oso_role(user: User, role: Role):
-    oso.insert(
+    get_oso().insert(
         ("has_role", Value("User", user.id), role, Value("Organization", "acme"))
     )
+    invalidate_oso_decisions(user)
+
+
+def add_oso_roles(users: list[User]):
+    """Write the role facts of many users in a single Oso API call."""
+    with get_oso().batch() as tx:
+        for user in users:
+            tx.insert(
+                (
+                    "has_role",
+                    Value("User", user.id),
+                    user.role,
+                    Value("Organization", "acme"),
+                )
+            )
+    actors = {_actor_key(user) for user in users}
+    decision_cache.delete_where(lambda key: key[0] in actors)
 
 
 def get_oso_role(user: User):
-    response = oso.get(
+    response = get_oso().get(
         ("has_role", Value("User", user.id), None, Value("Organization", "acme"))
     )
     try:
@@ -37,4 +103,22 @@ def get_oso_role(user: User):
 
 
 def is_oso_admin(user: User):
-    return oso.authorize(Value("User", user.id), "edit", Value("Organization", "acme"))
+    return is_allowed(user, "edit", Value("Organization", "acme"))
+
+
+def can_edit_organization(user: User, organization: str = ORGANIZATION) -> bool:
+    """Whether the user may change what the organization owns, e.g. documents."""
+    return is_allowed(user, "edit", Value("Organization", organization))
+
+
+def user_owner(user: User) -> str:
+    return f"User:{user.id}"
+
+
+def organization_owner(organization: str = ORGANIZATION) -> str:
+    return f"Organization:{organization}"
+
+
+def get_owner_scopes(user: User) -> list[str]:
+    """Owners whose documents the user can search: the user and their organization."""
+    return [user_owner(user), organization_owner()]
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+
+# Hashes with any other cost are upgraded (or downgraded) on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_pending = 0
+_rejected = 0
+_counter_lock = threading.Lock()
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def is_password_hash(value: str) -> bool:
+    return pwd_context.identify(value, required=False) is not None
+
+
+def verify_and_update(password: str, hashed: str) -> tuple[bool, str | None]:
+    """Check a password, returning a new hash when the stored one is outdated."""
+    return pwd_context.verify_and_update(password, hashed)
+
+
+def get_hashing_executor() -> ProcessPoolExecutor:
+    """Worker processes dedicated to bcrypt, sized apart from the API threads."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """Drop a broken pool so the next call starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_all(func: Callable, calls: list[tuple]) -> list:
+    """Run every call in the workers and wait for all of them.
+
+    A worker that dies (e.g. killed for memory) breaks the whole pool; it is
+    then replaced and the calls are retried once, as hashing has no side
+    effects.
+    """
+    for retry in (False, True):
+        executor = get_hashing_executor()
+        try:
+            futures = [executor.submit(func, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            if retry:
+                raise
+
+
+def shutdown_hashing_executor():
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+
+
+@contextmanager
+def _hashing_slot():
+    global _pending, _rejected
+    if not _slots.acquire(blocking=False):
+        with _counter_lock:
+            _rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many password operations in progress",
+        )
+
+    with _counter_lock:
+        _pending += 1
+    try:
+        yield
+    finally:
+        with _counter_lock:
+            _pending -= 1
+        _slots.release()
+
+
+def run_hashing(func: Callable, *args):
+    """Run a hashing function in the worker processes and wait for it.
+
+    Raises 429 once PASSWORD_HASH_MAX_PENDING calls are queued or running,
+    so a login spike is turned away instead of piling up request threads.
+    """
+    with _hashing_slot():
+        return _submit_all(func, [args])[0]
+
+
+def map_hashing(func: Callable, values: list) -> list:
+    """Apply a hashing function to many values, spread across all workers.
+
+    Values are submitted in waves of one per worker, so a login queued behind
+    a bulk operation waits for at most one wave instead of the whole batch.
+    The operation holds a single slot for its whole run.
+    """
+    results = []
+    with _hashing_slot():
+        for start in range(0, len(values), PASSWORD_HASH_WORKERS):
+            end = start + PASSWORD_HASH_WORKERS
+            results.extend(_submit_all(func, [(v,) for v in values[start:end]]))
+    return results
+
+
+def stats() -> dict:
+    with _counter_lock:
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            "pending": _pending,
+            "rejected": _rejected,
+        }
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Checkout counts and the time spent waiting for a connection."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": self.wait_total / attempts * 1000 if attempts else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+            }
+
+
+def timed_pool_class(base: type[QueuePool]) -> type[QueuePool]:
+    """Subclass a queue pool to time every checkout.
+
+    The metrics live on the class because SQLAlchemy recreates pools (on
+    dispose, or after a disconnect) from their class and arguments alone.
+    """
+
+    class TimedPool(base):
+        metrics = PoolMetrics()
+
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except exc.TimeoutError:
+                self.metrics.record(time.perf_counter() - start, timed_out=True)
+                raise
+            self.metrics.record(time.perf_counter() - start)
+            return connection
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def pool_stats(pool: QueuePool) -> dict:
+    """Current occupancy of the pool, plus its checkout metrics if timed."""
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    stats = {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": checked_out / capacity if capacity else 0.0,
+    }
+    if isinstance(getattr(pool, "metrics", None), PoolMetrics):
+        stats.update(pool.metrics.stats())
+    return stats
@@ -0,0 +1,190 @@
+import os
+
+from sqlalchemy import Row, Select, cast, func, literal, union_all
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlmodel import Session, select
+
+from app.models import (
+    TEXT_SEARCH_CONFIG,
+    VECTOR_QUANTIZATION,
+    Chunk,
+    quantized_distance,
+)
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidates fetched from a quantized index per result, before re-ranking.
+VECTOR_OVERSAMPLING = int(os.getenv("VECTOR_OVERSAMPLING", "4"))
+
+
+def first_pass_limit(limit: int, quantization: str = VECTOR_QUANTIZATION) -> int:
+    """Number of rows read from the ANN index to return `limit` results."""
+    return limit if quantization == "none" else limit * VECTOR_OVERSAMPLING
+
+
+def _nearest(
+    query_embedding: list[float],
+    limit: int,
+    quantization: str,
+    owner: str | None = None,
+) -> Select:
+    distance = Chunk.embedding.cosine_distance(query_embedding)
+    stmt = select(Chunk.id, distance.label("distance"))
+    if quantization == "none":
+        if owner is not None:
+            stmt = stmt.where(Chunk.owner == owner)
+        return stmt.order_by(distance).limit(limit)
+
+    candidates = select(Chunk.id)
+    if owner is not None:
+        candidates = candidates.where(Chunk.owner == owner)
+    candidates = (
+        candidates.order_by(
+            quantized_distance(Chunk.embedding, query_embedding, quantization)
+        )
+        .limit(first_pass_limit(limit, quantization))
+        .subquery()
+    )
+    return (
+        stmt.join(candidates, candidates.c.id == Chunk.id)
+        .order_by(distance)
+        .limit(limit)
+    )
+
+
+def nearest_chunks(
+    query_embedding: list[float],
+    limit: int,
+    quantization: str = VECTOR_QUANTIZATION,
+    owners: list[str] | None = None,
+):
+    """Subquery of the `limit` nearest chunk ids and their cosine distance.
+
+    With a quantized index the index is scanned for an oversampled set of
+    candidates, which are then re-ranked with the stored float32 vectors.
+
+    With `owners`, each owner is searched on its own and the results are
+    merged, so every search can use that owner's partial index (see
+    app.vector_index.create_owner_index) or, for small owners, an exact scan
+    of their rows. Filtering the global index instead would return fewer
+    than `limit` rows once most neighbours belong to other owners.
+    """
+    if owners is None:
+        return _nearest(query_embedding, limit, quantization).subquery()
+
+    searches = [
+        _nearest(query_embedding, limit, quantization, owner) for owner in owners
+    ]
+    merged = union_all(*searches).subquery()
+    return (
+        select(merged.c.id, merged.c.distance)
+        .order_by(merged.c.distance)
+        .limit(limit)
+        .subquery()
+    )
+
+
+def vector_search(
+    session: Session,
+    query_embedding: list[float],
+    top_k: int = RETRIEVAL_TOP_K,
+    max_distance: float | None = None,
+    quantization: str = VECTOR_QUANTIZATION,
+    owners: list[str] | None = None,
+) -> list[Row]:
+    """Return the `top_k` nearest chunks as (id, document_id, chunk_text, distance).
+
+    Only these columns are selected, so the stored embeddings never leave the
+    database. `owners` restricts the search to chunks of these owners.
+    """
+    nearest = nearest_chunks(query_embedding, top_k, quantization, owners)
+    stmt = select(
+        Chunk.id, Chunk.document_id, Chunk.chunk_text, nearest.c.distance
+    ).join(nearest, nearest.c.id == Chunk.id)
+    if max_distance is not None:
+        stmt = stmt.where(nearest.c.distance <= max_distance)
+    stmt = stmt.order_by(nearest.c.distance)
+    return list(session.exec(stmt).all())
+
+
+def hybrid_search(
+    session: Session,
+    query_text: str,
+    query_embedding: list[float],
+    top_k: int = RETRIEVAL_TOP_K,
+    max_distance: float | None = None,
+    candidates: int = HYBRID_CANDIDATES,
+    owners: list[str] | None = None,
+) -> list[Row]:
+    """Fuse full-text and vector rankings with reciprocal rank fusion.
+
+    Each side contributes its best `candidates` chunks, scored 1 / (k + rank);
+    both searches and the fusion run as a single statement. Rows carry the
+    fused `score` next to the vector `distance`.
+    """
+    distance = Chunk.embedding.cosine_distance(query_embedding)
+    vector_hits = nearest_chunks(query_embedding, candidates, owners=owners)
+    vector_ranked = select(
+        vector_hits.c.id,
+        func.row_number().over(order_by=vector_hits.c.distance).label("rank"),
+    ).cte("vector_ranked")
+
+    config = cast(literal(TEXT_SEARCH_CONFIG), REGCONFIG)
+    query = func.websearch_to_tsquery(config, query_text)
+    lexical_rank = func.ts_rank_cd(Chunk.search_vector, query)
+    lexical_hits = select(Chunk.id, lexical_rank.label("score")).where(
+        Chunk.search_vector.op("@@")(query)
+    )
+    if owners is not None:
+        lexical_hits = lexical_hits.where(Chunk.owner.in_(owners))
+    lexical_hits = (
+        lexical_hits.order_by(lexical_rank.desc()).limit(candidates).subquery()
+    )
+    lexical_ranked = select(
+        lexical_hits.c.id,
+        func.row_number().over(order_by=lexical_hits.c.score.desc()).label("rank"),
+    ).cte("lexical_ranked")
+
+    fused_id = func.coalesce(vector_ranked.c.id, lexical_ranked.c.id)
+    score = func.coalesce(1.0 / (RRF_K + vector_ranked.c.rank), 0.0) + func.coalesce(
+        1.0 / (RRF_K + lexical_ranked.c.rank), 0.0
+    )
+    fused = (
+        select(fused_id.label("id"), score.label("score"))
+        .select_from(
+            vector_ranked.join(
+                lexical_ranked,
+                vector_ranked.c.id == lexical_ranked.c.id,
+                full=True,
+            )
+        )
+        .subquery()
+    )
+    stmt = select(
+        Chunk.id,
+        Chunk.document_id,
+        Chunk.chunk_text,
+        distance.label("distance"),
+        fused.c.score,
+    ).join(fused, fused.c.id == Chunk.id)
+    if max_distance is not None:
+        stmt = stmt.where(distance <= max_distance)
+    stmt = stmt.order_by(fused.c.score.desc()).limit(top_k)
+    return list(session.exec(stmt).all())
+
+
+def chunk_sources(rows: list[Row]) -> list[dict]:
+    """Describe retrieved chunks for API responses."""
+    sources = []
+    for row in rows:
+        source = {
+            "chunk_id": str(row.id),
+            "document_id": str(row.document_id),
+            "distance": float(row.distance),
+        }
+        if "score" in row._fields:
+            source["score"] = float(row.score)
+        sources.append(source)
+    return sources
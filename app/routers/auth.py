@@ -5,16 +5,11 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from sqlmodel import Session
 
-from app.dependencies import get_session
-from app.helpers import (
-    create_access_token,
-    get_password_hash,
-    get_user_by_email,
-    get_user_by_username,
-    verify_password,
-)
+from app.dependencies import forget_user, get_session
+from app.helpers import create_access_token, get_user_by_email, get_user_by_username
 from app.models import Role, User
 from app.oso import add_oso_role
+from app.passwords import hash_password, run_hashing, verify_and_update
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
@@ -33,13 +28,25 @@ def post_login(
     session: Session = Depends(get_session),
 ):
     user = get_user_by_username(session, form_data.username)
-    if not user or not verify_password(form_data.password, user.password):
+    valid, new_hash = (
+        run_hashing(verify_and_update, form_data.password, user.password)
+        if user
+        else (False, None)
+    )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
+
+    if new_hash:
+        # Stored with an outdated cost factor.
+        user.password = new_hash
+        session.add(user)
+        session.commit()
+        forget_user(user.username)
     access_token = create_access_token(
-        data={"sub": user.username, "role": user.role},
+        data={"sub": user.username, "uid": str(user.id), "role": user.role},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
     )
     return {"access_token": access_token, "token_type": "bearer"}
@@ -65,7 +72,7 @@ def post_register(
     user = User(
         username=new_user.username,
         email=new_user.email,
-        password=get_password_hash(new_user.password),
+        password=run_hashing(hash_password, new_user.password),
         role=Role.USER,
     )
 
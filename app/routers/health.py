@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException, Request, status
+
+router = APIRouter()
+
+
+@router.get("/live/")
+def get_live():
+    return {"status": "ok"}
+
+
+@router.get("/ready/")
+def get_ready(request: Request):
+    """Only succeeds once the embedding model and database pools are warm."""
+    if not request.app.state.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Not ready"
+        )
+
+    return {"status": "ready"}
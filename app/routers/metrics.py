@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app import passwords
+from app.dependencies import get_current_identity
+from app.helpers import embedding_batcher, embedding_cache
+from app.models import User, async_engine, engine
+from app.oso import decision_cache, is_oso_admin
+from app.pools import pool_stats
+
+router = APIRouter()
+
+
+@router.get("/")
+def get_metrics(current_user: User = Depends(get_current_identity)):
+    if not is_oso_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed",
+        )
+
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "oso_decision_cache": decision_cache.stats(),
+        "password_hashing": passwords.stats(),
+        "db_pool": pool_stats(engine.pool),
+        "async_db_pool": pool_stats(async_engine.pool),
+    }
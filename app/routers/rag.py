@@ -1,67 +1,481 @@
+import functools
+import json
 import os
+import uuid
+from typing import Literal
 
 import openai
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.dependencies import get_current_user, get_session
-from app.helpers import chunk_text, create_embedding
-from app.models import Chunk, Document
+from app.answer_cache import (
+    bump_corpus_version,
+    cache_answer,
+    find_cached_answer,
+    get_corpus_version,
+)
+from app.dependencies import get_async_session, get_current_identity, get_session
+from app.helpers import (
+    chunk_text,
+    content_hash,
+    count_cache_hits,
+    create_embedding,
+    create_embedding_async,
+    get_cached_embeddings,
+    ingestion_stats,
+    insert_chunk_rows,
+    insert_chunks,
+    iter_chunk_rows,
+    iter_chunks,
+    run_in_embedding_executor,
+    update_chunks,
+)
+from app.ingestion import submit_ingestion_job
+from app.models import Document, IngestionJob, User
+from app.oso import (
+    can_edit_organization,
+    get_owner_scopes,
+    organization_owner,
+    user_owner,
+)
+from app.retrieval import (
+    HYBRID_CANDIDATES,
+    RETRIEVAL_MODE,
+    RETRIEVAL_TOP_K,
+    chunk_sources,
+    first_pass_limit,
+    hybrid_search,
+    vector_search,
+)
+from app.uploads import DocumentIngest, iter_upload_events
+from app.vector_index import HNSW_EF_SEARCH, set_search_params
 
 router = APIRouter()
 
-client = openai.Client()
-client.api_key = os.getenv("OPENAI_API_KEY")
+
+@functools.cache
+def get_async_client() -> openai.AsyncOpenAI:
+    return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
 class QueryRequest(BaseModel):
     text: str
+    mode: Literal["vector", "hybrid"] = RETRIEVAL_MODE
+    top_k: int = Field(default=RETRIEVAL_TOP_K, gt=0, le=100)
+    # Cosine distance; chunks farther from the question are not used as context.
+    max_distance: float | None = Field(default=None, ge=0, le=2)
+    ef_search: int | None = Field(default=None, gt=0, le=1000)
+    probes: int | None = Field(default=None, gt=0, le=10000)
+
+
+def retrieval_key(request: QueryRequest) -> str:
+    """Identify the retrieval parameters of a query for the answer cache."""
+    return request.model_dump_json(exclude={"text"})
+
+
+def check_can_edit(user: User, owner: str):
+    """Only users who may edit the organization change its documents."""
+    if owner == organization_owner() and not can_edit_organization(user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
 
+def document_owner(user: User, shared: bool) -> str:
+    """Shared documents belong to the user's organization, others to the user."""
+    owner = organization_owner() if shared else user_owner(user)
+    check_can_edit(user, owner)
+    return owner
+
+
+@router.post("/upload/")
+def upload_text(
+    document: Document,
+    response: Response,
+    background: bool = False,
+    shared: bool = False,
+    user: User = Depends(get_current_identity),
+    session: Session = Depends(get_session),
+):
+    document.owner = document_owner(user, shared)
+    if background:
+        job = submit_ingestion_job(session, document)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "message": "Text accepted for processing",
+            "document_id": document.id,
+            "job_id": job.id,
+        }
 
-@router.post("/upload/", dependencies=[Depends(get_current_user)])
-def upload_text(document: Document, session: Session = Depends(get_session)):
     session.add(document)
-    session.commit()
-    session.refresh(document)
+    session.flush()
 
-    chunks = chunk_text(document.text)
-    for chunk in chunks:
-        embedding = create_embedding(chunk)
-        chunk_entry = Chunk(
-            document_id=document.id, chunk_text=chunk, embedding=embedding
-        )
-        session.add(chunk_entry)
+    stats = insert_chunks(
+        session, document.id, document.owner, iter_chunks(document.text)
+    )
+    bump_corpus_version(session)
 
     session.commit()
     return {
         "message": "Text uploaded and processed successfully",
         "document_id": document.id,
+        **stats,
+    }
+
+
+@router.post("/upload/async/")
+async def upload_text_async(
+    document: Document,
+    shared: bool = False,
+    user: User = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session),
+):
+    document.owner = await run_in_threadpool(document_owner, user, shared)
+    session.add(document)
+    await session.flush()
+    # Read before commit: expired attributes cannot be lazy-loaded here.
+    document_id = document.id
+
+    chunks = await run_in_embedding_executor(chunk_text, document.text)
+    cached = await session.run_sync(get_cached_embeddings, map(content_hash, chunks))
+
+    # Embedding advances one batch at a time off the event loop.
+    batches = iter_chunk_rows(document_id, document.owner, chunks, cached=cached)
+    while batch := await run_in_embedding_executor(next, batches, None):
+        rows, hits = batch
+        await session.run_sync(insert_chunk_rows, rows, hits)
+
+    await session.run_sync(bump_corpus_version)
+    await session.commit()
+
+    return {
+        "message": "Text uploaded and processed successfully",
+        "document_id": document_id,
+        **ingestion_stats(len(chunks), count_cache_hits(chunks, cached)),
+    }
+
+
+@router.post("/upload/stream/")
+async def upload_stream(
+    request: Request,
+    shared: bool = False,
+    user: User = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Ingest plain text or multipart files while the body is being received.
+
+    Every multipart part becomes its own document. Text is decoded, chunked,
+    embedded and inserted incrementally, so uploads of any size stay out of
+    memory. Streamed documents keep their content only as chunks.
+    """
+    owner = await run_in_threadpool(document_owner, user, shared)
+    documents = []
+    ingest = None
+    async for event, value in iter_upload_events(request):
+        if event == "begin":
+            ingest = DocumentIngest(session, value, owner)
+            await ingest.start()
+        elif event == "data":
+            await ingest.feed(value)
+        else:
+            await ingest.close()
+            documents.append(
+                {
+                    "document_id": ingest.document.id,
+                    "name": ingest.document.name,
+                    **ingestion_stats(ingest.chunks, ingest.cache_hits),
+                }
+            )
+
+    if not documents:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No documents uploaded"
+        )
+
+    await session.run_sync(bump_corpus_version)
+    await session.commit()
+    return {
+        "message": "Text uploaded and processed successfully",
+        "documents": documents,
+    }
+
+
+class DocumentUpdate(BaseModel):
+    text: str
+    name: str | None = None
+
+
+@router.put("/documents/{document_id}/")
+def update_document(
+    document_id: uuid.UUID,
+    update: DocumentUpdate,
+    user: User = Depends(get_current_identity),
+    session: Session = Depends(get_session),
+):
+    """Replace a document's text, re-embedding only the chunks that changed."""
+    document = session.get(Document, document_id, with_for_update=True)
+    if document is None or document.owner not in get_owner_scopes(user):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
+    check_can_edit(user, document.owner)
+
+    stats = update_chunks(session, document_id, document.owner, chunk_text(update.text))
+    document.text = update.text
+    if update.name is not None:
+        document.name = update.name
+    session.add(document)
+    if stats["added"] or stats["removed"]:
+        bump_corpus_version(session)
+
+    session.commit()
+    return {
+        "message": "Document updated successfully",
+        "document_id": document_id,
+        **stats,
     }
 
 
-@router.post("/query/", dependencies=[Depends(get_current_user)])
-def query_text(request: QueryRequest, session: Session = Depends(get_session)):
+@router.get("/jobs/{job_id}/")
+def get_job(
+    job_id: uuid.UUID,
+    user: User = Depends(get_current_identity),
+    session: Session = Depends(get_session),
+):
+    job = session.get(IngestionJob, job_id, populate_existing=True)
+    document = job and session.get(Document, job.document_id)
+    if document is None or document.owner not in get_owner_scopes(user):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+
+    return job
+
+
+def build_messages(context: list[str], question: str) -> list[dict]:
+    prompt_context = "\n".join(context)
+    return [
+        {
+            "role": "system",
+            "content": "Answer the question based on the provided context.",
+        },
+        {
+            "role": "user",
+            "content": f"Context:\n{prompt_context}\n\nQuestion: {question}",
+        },
+    ]
+
+
+def retrieve_context(
+    session: Session,
+    request: QueryRequest,
+    query_embedding: list[float],
+    owners: list[str],
+) -> tuple[list[str], list[dict]]:
+    """Return the context texts and their sources, best match first.
+
+    Only chunks of `owners` are searched.
+    """
+    # HNSW returns at most ef_search rows, which must cover the first pass.
+    limit = HYBRID_CANDIDATES if request.mode == "hybrid" else request.top_k
+    ef_search = max(request.ef_search or HNSW_EF_SEARCH, first_pass_limit(limit))
+    ef_search = min(ef_search, 1000)
+    set_search_params(session, ef_search, request.probes)
+    if request.mode == "hybrid":
+        rows = hybrid_search(
+            session,
+            request.text,
+            query_embedding,
+            top_k=request.top_k,
+            max_distance=request.max_distance,
+            owners=owners,
+        )
+    else:
+        rows = vector_search(
+            session,
+            query_embedding,
+            top_k=request.top_k,
+            max_distance=request.max_distance,
+            owners=owners,
+        )
+    return [row.chunk_text for row in rows], chunk_sources(rows)
+
+
+def server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/query/")
+def query_text(
+    request: QueryRequest,
+    user: User = Depends(get_current_identity),
+    session: Session = Depends(get_session),
+):
     query_embedding = create_embedding(request.text)
 
-    stmt = select(Chunk).order_by(Chunk.embedding.op("<=>")(query_embedding)).limit(3)
-    top_chunks = session.exec(stmt).all()
+    corpus_version = get_corpus_version(session)
+    cached = find_cached_answer(
+        session,
+        query_embedding,
+        corpus_version,
+        user_owner(user),
+        retrieval_key(request),
+    )
+    if cached:
+        return {
+            "answer": cached.answer,
+            "context": cached.context,
+            "sources": cached.sources,
+            "cached": True,
+        }
 
-    context = "\n".join([chunk.chunk_text for chunk in top_chunks])
+    context, sources = retrieve_context(
+        session, request, query_embedding, get_owner_scopes(user)
+    )
 
     response = openai.chat.completions.create(
         model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": "Answer the question based on the provided context.",
-            },
-            {
-                "role": "user",
-                "content": f"Context:\n{context}\n\nQuestion: {request.text}",
-            },
-        ],
+        messages=build_messages(context, request.text),
     )
 
     answer = response.choices[0].message.content
-    return {"answer": answer, "context": [chunk.chunk_text for chunk in top_chunks]}
+    cache_answer(
+        session,
+        request.text,
+        query_embedding,
+        answer,
+        context,
+        corpus_version,
+        sources,
+        user_owner(user),
+        retrieval_key(request),
+    )
+    return {"answer": answer, "context": context, "sources": sources, "cached": False}
+
+
+@router.post("/query/async/")
+async def query_text_async(
+    request: QueryRequest,
+    user: User = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session),
+):
+    query_embedding = await create_embedding_async(request.text)
+
+    corpus_version = await session.run_sync(get_corpus_version)
+    cached = await session.run_sync(
+        find_cached_answer,
+        query_embedding,
+        corpus_version,
+        user_owner(user),
+        retrieval_key(request),
+    )
+    if cached:
+        return {
+            "answer": cached.answer,
+            "context": cached.context,
+            "sources": cached.sources,
+            "cached": True,
+        }
+
+    context, sources = await session.run_sync(
+        retrieve_context, request, query_embedding, get_owner_scopes(user)
+    )
+    # Hand the connection back to the pool while the model answers, so the
+    # number of LLM calls in flight is not capped by the pool size.
+    await session.commit()
+
+    response = await get_async_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=build_messages(context, request.text),
+    )
+
+    answer = response.choices[0].message.content
+    await session.run_sync(
+        cache_answer,
+        request.text,
+        query_embedding,
+        answer,
+        context,
+        corpus_version,
+        sources,
+        user_owner(user),
+        retrieval_key(request),
+    )
+    return {"answer": answer, "context": context, "sources": sources, "cached": False}
+
+
+@router.post("/query/stream/")
+def query_text_stream(
+    request: QueryRequest,
+    user: User = Depends(get_current_identity),
+    session: Session = Depends(get_session),
+):
+    """Stream the answer as Server-Sent Events.
+
+    A `context` event with the retrieved chunks and a `sources` event with their
+    ids and distances are sent first, followed by one `token` event per model
+    delta and a final `done` event.
+    """
+    query_embedding = create_embedding(request.text)
+
+    owner = user_owner(user)
+    corpus_version = get_corpus_version(session)
+    retrieval = retrieval_key(request)
+    cached = find_cached_answer(
+        session, query_embedding, corpus_version, owner, retrieval
+    )
+    if cached:
+        context, sources, cached_answer = cached.context, cached.sources, cached.answer
+    else:
+        context, sources = retrieve_context(
+            session, request, query_embedding, get_owner_scopes(user)
+        )
+        cached_answer = None
+
+    # The request session is closed before the body is streamed.
+    bind = session.get_bind()
+
+    def events():
+        yield server_sent_event("context", context)
+        yield server_sent_event("sources", sources)
+
+        if cached_answer is not None:
+            yield server_sent_event("token", cached_answer)
+            yield server_sent_event("done", {"cached": True})
+            return
+
+        stream = openai.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=build_messages(context, request.text),
+            stream=True,
+        )
+
+        tokens = []
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            tokens.append(chunk.choices[0].delta.content)
+            yield server_sent_event("token", tokens[-1])
+
+        yield server_sent_event("done", {"cached": False})
+
+        with Session(bind) as cache_session:
+            cache_answer(
+                cache_session,
+                request.text,
+                query_embedding,
+                "".join(tokens),
+                context,
+                corpus_version,
+                sources,
+                owner,
+                retrieval,
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
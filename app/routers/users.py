@@ -1,46 +1,128 @@
+import os
 import uuid
+from typing import Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlmodel import Session, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.dependencies import get_async_session, get_current_user, get_session
-from app.helpers import get_password_hash, get_user_by_email, get_user_by_username
+from app.dependencies import (
+    forget_user,
+    get_async_session,
+    get_current_user,
+    get_session,
+)
+from app.helpers import get_user_by_email, get_user_by_username
 from app.models import Role, User
 from app.oso import add_oso_role, delete_oso_user, is_oso_admin
+from app.passwords import hash_password, run_hashing
+from app.user_import import import_users, parse_import
+
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+USERS_MAX_PAGE_SIZE = int(os.getenv("USERS_MAX_PAGE_SIZE", "1000"))
+USERS_EXPORT_BATCH_SIZE = int(os.getenv("USERS_EXPORT_BATCH_SIZE", "1000"))
 
 router = APIRouter()
 
+UserOrder = Literal["id", "username"]
+
 
 class RoleUpdateRequest(BaseModel):
     role: Role
 
 
-@router.get("/async/")
-async def get_users_async(
-    user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_async_session),
+def users_query(
+    user: User,
+    order_by: str = "id",
+    after: str | None = None,
+    limit: int | None = None,
 ):
-    query = select(User)
+    """Select the users visible to `user`, one keyset page at a time.
+
+    Pages are ordered by a unique column and continue after the last value of
+    the previous page, so each page costs one index range scan no matter how
+    deep it is.
+    """
+    column = getattr(User, order_by)
+    query = select(User).order_by(column)
 
     if not is_oso_admin(user):
         query = query.where(User.id == user.id)
 
+    if after is not None:
+        if order_by == "id":
+            try:
+                after = uuid.UUID(after)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+                )
+        query = query.where(column > after)
+
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def paginate(response: Response, users: list[User], order_by: str, limit: int):
+    """Point the client at the next page through the X-Next-Cursor header."""
+    if len(users) == limit:
+        response.headers["X-Next-Cursor"] = str(getattr(users[-1], order_by))
+    return users
+
+
+@router.get("/async/")
+async def get_users_async(
+    response: Response,
+    order_by: UserOrder = "id",
+    after: str | None = None,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    query = users_query(user, order_by, after, limit)
     result = await session.execute(query)
-    return result.scalars().all()
+    return paginate(response, result.scalars().all(), order_by, limit)
 
 
 @router.get("/")
 def get_users(
-    user: User = Depends(get_current_user), session: Session = Depends(get_session)
+    response: Response,
+    order_by: UserOrder = "id",
+    after: str | None = None,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
 ):
-    query = select(User)
+    """List users a page at a time; pass X-Next-Cursor back as `after`."""
+    query = users_query(user, order_by, after, limit)
+    return paginate(response, session.exec(query).all(), order_by, limit)
 
-    if not is_oso_admin(user):
-        query = query.where(User.id == user.id)
 
-    return session.exec(query).all()
+@router.get("/export/")
+def export_users(
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Stream every visible user as newline-delimited JSON.
+
+    Rows are fetched through a server-side cursor in batches, so the export
+    runs in constant memory however many users there are.
+    """
+    query = users_query(user).execution_options(yield_per=USERS_EXPORT_BATCH_SIZE)
+
+    # The request session is closed before the body is streamed.
+    bind = session.get_bind()
+
+    def lines():
+        with Session(bind) as export_session:
+            for row in export_session.exec(query):
+                yield row.model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @router.post("/")
@@ -67,7 +149,7 @@ def post_user(
             detail="email already exists",
         )
 
-    user.password = get_password_hash(user.password)
+    user.password = run_hashing(hash_password, user.password)
     session.add(user)
     session.commit()
     session.refresh(user)
@@ -75,6 +157,30 @@ def post_user(
     return user
 
 
+@router.post("/import/")
+async def post_users_import(
+    request: Request,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Create users in bulk from a JSON array or a CSV file (text/csv).
+
+    Rows have username, email, role and either password or password_hash.
+    The response reports the outcome of every row.
+    """
+    # Oso calls and parsing a large body block, so they stay off the event loop.
+    if not await run_in_threadpool(is_oso_admin, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed",
+        )
+
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    rows = await run_in_threadpool(parse_import, content_type, body)
+    return await run_in_threadpool(import_users, session, rows)
+
+
 @router.get("/me/")
 def get_me(current_user: User = Depends(get_current_user)):
     return current_user
@@ -128,12 +234,16 @@ def put_user(
             detail="email already exists",
         )
 
+    old_username = user.username
     user.username = updated_user.username
     user.email = updated_user.email
-    user.password = get_password_hash(updated_user.password)
+    user.password = run_hashing(hash_password, updated_user.password)
 
     session.add(user)
     session.commit()
+    # Evicted after the commit, so a concurrent request cannot cache the old
+    # row again.
+    forget_user(old_username)
     session.refresh(user)
     return user
 
@@ -155,6 +265,7 @@ def delete_user(
 
     session.delete(user)
     session.commit()
+    forget_user(user.username)
     delete_oso_user(user)
     return {"message": "User deleted"}
 
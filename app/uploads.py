@@ -0,0 +1,158 @@
+import codecs
+from collections.abc import AsyncIterator
+
+from fastapi import HTTPException, Request, status
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.helpers import (
+    EMBEDDING_BATCH_SIZE,
+    Chunker,
+    content_hash,
+    count_cache_hits,
+    embed_chunk_rows,
+    get_cached_embeddings,
+    insert_chunk_rows,
+    run_in_embedding_executor,
+)
+from app.models import Document
+
+
+class _MultipartEvents:
+    """Collects python-multipart callbacks as (event, value) tuples."""
+
+    def __init__(self, boundary: bytes):
+        self.events: list[tuple[str, bytes | str | None]] = []
+        self._headers: dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+        # Whether a part has begun and not ended yet.
+        self.in_part = False
+        self.parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        name = options.get(b"filename") or options.get(b"name") or b""
+        self.events.append(("begin", name.decode("latin-1") or None))
+        self.in_part = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self.events.append(("end", None))
+        self.in_part = False
+
+
+async def iter_upload_events(
+    request: Request,
+) -> AsyncIterator[tuple[str, bytes | str | None]]:
+    """Turn the raw request body into ("begin", name), ("data", bytes), ("end",)
+    events while it is still being received.
+
+    A multipart/form-data body yields one document per part; any other body is
+    a single document.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data":
+        yield "begin", request.headers.get("x-filename")
+        async for data in request.stream():
+            yield "data", data
+        yield "end", None
+        return
+
+    if b"boundary" not in options:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing multipart boundary",
+        )
+
+    multipart = _MultipartEvents(options[b"boundary"])
+    async for data in request.stream():
+        multipart.parser.write(data)
+        events, multipart.events = multipart.events, []
+        for event in events:
+            yield event
+    multipart.parser.finalize()
+    for event in multipart.events:
+        yield event
+    # A truncated body never ends its last part; failing rolls back the
+    # batches of it that were already inserted.
+    if multipart.in_part:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Multipart body ends before the closing boundary",
+        )
+
+
+class DocumentIngest:
+    """Decodes, chunks, embeds and inserts one document as its bytes arrive.
+
+    Only the undecoded tail, the chunks of one embedding batch and one batch
+    of rows are held in memory at any time.
+    """
+
+    def __init__(self, session: AsyncSession, name: str | None, owner: str):
+        self.session = session
+        self.document = Document(text="", name=name, owner=owner)
+        self.chunks = 0
+        self.cache_hits = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._chunker = Chunker()
+        self._pending: list[str] = []
+
+    async def start(self):
+        self.session.add(self.document)
+        await self.session.flush()
+
+    async def feed(self, data: bytes):
+        text = self._decoder.decode(data)
+        self._pending += await run_in_embedding_executor(self._chunker.feed, text)
+        while len(self._pending) >= EMBEDDING_BATCH_SIZE:
+            await self._insert(self._pending[:EMBEDDING_BATCH_SIZE])
+            self._pending = self._pending[EMBEDDING_BATCH_SIZE:]
+
+    async def close(self):
+        text = self._decoder.decode(b"", final=True)
+        self._pending += await run_in_embedding_executor(self._chunker.feed, text)
+        self._pending += await run_in_embedding_executor(self._chunker.close)
+        while self._pending:
+            await self._insert(self._pending[:EMBEDDING_BATCH_SIZE])
+            self._pending = self._pending[EMBEDDING_BATCH_SIZE:]
+
+    async def _insert(self, chunks: list[str]):
+        # The whole document is not known up front, so the embedding cache is
+        # queried once per batch.
+        cached = await self.session.run_sync(
+            get_cached_embeddings, map(content_hash, chunks)
+        )
+        rows = await run_in_embedding_executor(
+            embed_chunk_rows, self.document.id, self.document.owner, chunks, cached
+        )
+        await self.session.run_sync(insert_chunk_rows, rows, cached)
+        self.chunks += len(rows)
+        self.cache_hits += count_cache_hits(chunks, cached)
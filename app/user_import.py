@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+import os
+import uuid
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError, model_validator
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+
+from app.models import Role, User
+from app.oso import add_oso_roles
+from app.passwords import hash_password, is_password_hash, map_hashing
+
+USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", "50000"))
+
+
+class UserImport(BaseModel):
+    username: str
+    email: str
+    password: str | None = None
+    # An existing bcrypt hash, e.g. when migrating users from another system.
+    password_hash: str | None = None
+    role: Role = Role.USER
+
+    @model_validator(mode="after")
+    def check_password(self):
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError("exactly one of password and password_hash is required")
+        if self.password_hash is not None and not is_password_hash(self.password_hash):
+            raise ValueError("password_hash is not a supported hash")
+        return self
+
+
+def parse_import(content_type: str, body: bytes) -> list[dict]:
+    """Read the rows of a JSON array or a CSV file with a header line."""
+    if content_type.startswith("text/csv"):
+        reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+        # Empty cells fall back to the defaults, e.g. for the role.
+        rows = [{k: v for k, v in row.items() if k and v} for row in reader]
+    else:
+        try:
+            rows = json.loads(body)
+        except ValueError:
+            rows = None
+        if not isinstance(rows, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array or a CSV file",
+            )
+
+    if len(rows) > USER_IMPORT_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {USER_IMPORT_MAX_ROWS} users can be imported at once",
+        )
+    return rows
+
+
+def import_users(session: Session, rows: list[dict]) -> dict:
+    """Create many users with one conflict query, one insert and one Oso call.
+
+    Every row gets an entry in the report, in input order. Rows that are
+    invalid or conflict with existing users or earlier rows are skipped; the
+    others are created.
+    """
+    report: list[dict] = []
+    users: dict[int, UserImport] = {}
+    for i, row in enumerate(rows):
+        try:
+            users[i] = UserImport.model_validate(row)
+            report.append({"row": i, "username": users[i].username})
+        except ValidationError as e:
+            username = row.get("username") if isinstance(row, dict) else None
+            report.append(_failed(i, username, _validation_detail(e)))
+
+    existing = session.exec(
+        select(User.username, User.email).where(
+            or_(
+                User.username.in_({u.username for u in users.values()}),
+                User.email.in_({u.email for u in users.values()}),
+            )
+        )
+    ).all()
+    usernames = {username for username, _ in existing}
+    emails = {email for _, email in existing}
+
+    for i, user in list(users.items()):
+        if user.username in usernames:
+            report[i] = _failed(i, user.username, "username already exists")
+            del users[i]
+        elif user.email in emails:
+            report[i] = _failed(i, user.username, "email already exists")
+            del users[i]
+        else:
+            usernames.add(user.username)
+            emails.add(user.email)
+
+    plain = [i for i, user in users.items() if user.password is not None]
+    hashes = {}
+    if plain:
+        passwords = map_hashing(hash_password, [users[i].password for i in plain])
+        hashes = dict(zip(plain, passwords))
+
+    created = {
+        i: User(
+            id=uuid.uuid4(),
+            username=user.username,
+            email=user.email,
+            password=hashes.get(i, user.password_hash),
+            role=user.role,
+        )
+        for i, user in users.items()
+    }
+    inserted = set()
+    if created:
+        # A concurrent request may have taken a name since the conflict query.
+        stmt = pg_insert(User).on_conflict_do_nothing().returning(User.id)
+        inserted = set(
+            session.exec(
+                stmt,
+                params=[
+                    {
+                        "id": user.id,
+                        "username": user.username,
+                        "email": user.email,
+                        "password": user.password,
+                        "role": user.role,
+                    }
+                    for user in created.values()
+                ],
+            ).scalars()
+        )
+    session.commit()
+
+    for i, user in created.items():
+        if user.id in inserted:
+            report[i].update(status="created", id=user.id)
+        else:
+            report[i] = _failed(i, user.username, "username or email already exists")
+    add_oso_roles([user for user in created.values() if user.id in inserted])
+
+    return {
+        "created": len(inserted),
+        "failed": len(report) - len(inserted),
+        "results": report,
+    }
+
+
+def _failed(row: int, username: str | None, detail: str) -> dict:
+    return {"row": row, "username": username, "status": "failed", "detail": detail}
+
+
+def _validation_detail(error: ValidationError) -> str:
+    return "; ".join(
+        ".".join(map(str, e["loc"])) + ": " + e["msg"] if e["loc"] else e["msg"]
+        for e in error.errors()
+    )
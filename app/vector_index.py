@@ -0,0 +1,170 @@
+import hashlib
+import math
+import os
+
+from sqlalchemy import Engine, func, text
+from sqlmodel import Session, select
+
+from app.models import (
+    VECTOR_INDEX_NAME,
+    VECTOR_INDEX_OPS,
+    VECTOR_INDEX_TYPE,
+    VECTOR_QUANTIZATION,
+    Chunk,
+    default_vector_index_params,
+)
+
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# pgvector >= 0.8 keeps scanning a filtered HNSW index until enough rows pass
+# the filter. Empty leaves the server default, for older pgvector versions.
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+
+INDEX_TYPES = ("hnsw", "ivfflat")
+QUANTIZATIONS = tuple(VECTOR_INDEX_OPS)
+
+# Must match app.models.quantize, or the planner will not use the index.
+INDEX_EXPRESSIONS = {
+    "none": "embedding",
+    "halfvec": "(embedding::halfvec(384))",
+    "bit": "(binary_quantize(embedding)::bit(384))",
+}
+
+
+def recommended_index_params(session: Session, index_type: str) -> dict[str, int]:
+    """Pick build parameters from the current size of the chunk table.
+
+    IVFFlat follows the pgvector guidance of rows / 1000 lists up to 1M rows
+    and sqrt(rows) beyond that. HNSW does not depend on the row count.
+    """
+    params = default_vector_index_params(index_type)
+    if index_type == "ivfflat":
+        rows = session.exec(select(func.count()).select_from(Chunk)).one()
+        lists = rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows))
+        params["lists"] = max(lists, 1)
+    return params
+
+
+def index_ddl(
+    index_type: str = VECTOR_INDEX_TYPE,
+    params: dict[str, int] | None = None,
+    name: str = VECTOR_INDEX_NAME,
+    quantization: str = VECTOR_QUANTIZATION,
+    owner: str | None = None,
+) -> str:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown vector quantization: {quantization}")
+
+    params = params or default_vector_index_params(index_type)
+    options = ", ".join(f"{key} = {int(value)}" for key, value in params.items())
+    column = f"{INDEX_EXPRESSIONS[quantization]} {VECTOR_INDEX_OPS[quantization]}"
+    ddl = (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON chunk "
+        f"USING {index_type} ({column}) WITH ({options})"
+    )
+    if owner is not None:
+        ddl += " WHERE owner = '{}'".format(owner.replace("'", "''"))
+    return ddl
+
+
+def _set_maintenance_work_mem(conn, maintenance_work_mem: str | None):
+    if maintenance_work_mem:
+        conn.execute(
+            text("SELECT set_config('maintenance_work_mem', :value, false)"),
+            {"value": maintenance_work_mem},
+        )
+
+
+def create_index(
+    engine: Engine,
+    index_type: str = VECTOR_INDEX_TYPE,
+    params: dict[str, int] | None = None,
+    maintenance_work_mem: str | None = None,
+    quantization: str = VECTOR_QUANTIZATION,
+):
+    """Create the ANN index without blocking writes to the chunk table."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _set_maintenance_work_mem(conn, maintenance_work_mem)
+        conn.execute(text(index_ddl(index_type, params, quantization=quantization)))
+
+
+def rebuild_index(
+    engine: Engine,
+    index_type: str = VECTOR_INDEX_TYPE,
+    params: dict[str, int] | None = None,
+    maintenance_work_mem: str | None = None,
+    quantization: str = VECTOR_QUANTIZATION,
+):
+    """Build a new index next to the live one, then swap it in.
+
+    Queries keep using the old index until the new one is ready, so a rebuild
+    with different parameters never falls back to a sequential scan. This is
+    also how existing databases move to a quantized index: the stored vectors
+    do not change, only the index is rebuilt on the quantized expression.
+    """
+    new_name = f"{VECTOR_INDEX_NAME}_new"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _set_maintenance_work_mem(conn, maintenance_work_mem)
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}"))
+        conn.execute(
+            text(index_ddl(index_type, params, new_name, quantization=quantization))
+        )
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}"))
+        conn.execute(text(f"ALTER INDEX {new_name} RENAME TO {VECTOR_INDEX_NAME}"))
+
+
+def owner_index_name(owner: str) -> str:
+    return f"chunk_embedding_{hashlib.sha1(owner.encode()).hexdigest()[:16]}_idx"
+
+
+def create_owner_index(
+    engine: Engine,
+    owner: str,
+    index_type: str = VECTOR_INDEX_TYPE,
+    params: dict[str, int] | None = None,
+    maintenance_work_mem: str | None = None,
+    quantization: str = VECTOR_QUANTIZATION,
+):
+    """Create an ANN index over the chunks of one owner only.
+
+    Scoped searches of that owner walk this index instead of filtering the
+    global one, so recall does not depend on how many chunks other owners
+    have. Worth it for large owners; small ones are searched exactly through
+    the owner column index.
+    """
+    name = owner_index_name(owner)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _set_maintenance_work_mem(conn, maintenance_work_mem)
+        conn.execute(text(index_ddl(index_type, params, name, quantization, owner)))
+
+
+def drop_owner_index(engine: Engine, owner: str):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(
+            text(f"DROP INDEX CONCURRENTLY IF EXISTS {owner_index_name(owner)}")
+        )
+
+
+def drop_index(engine: Engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}"))
+
+
+def set_search_params(
+    session: Session, ef_search: int | None = None, probes: int | None = None
+):
+    """Tune the ANN search for the current transaction only, in one round trip."""
+    calls = [
+        "set_config('hnsw.ef_search', :ef_search, true)",
+        "set_config('ivfflat.probes', :probes, true)",
+    ]
+    params = {
+        "ef_search": str(ef_search or HNSW_EF_SEARCH),
+        "probes": str(probes or IVFFLAT_PROBES),
+    }
+    if HNSW_ITERATIVE_SCAN:
+        calls.append("set_config('hnsw.iterative_scan', :iterative_scan, true)")
+        params["iterative_scan"] = HNSW_ITERATIVE_SCAN
+    session.exec(text("SELECT " + ", ".join(calls)), params=params)
@@ -0,0 +1,47 @@
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.embedding_backends import BACKENDS, get_embedding_backend  # noqa
+
+QUERIES = 200
+SENTENCE = "How do I rotate the API keys used by the ingestion service?"
+
+
+def run(name: str):
+    start = time.perf_counter()
+    backend = get_embedding_backend(name)
+    load_time = time.perf_counter() - start
+
+    backend.encode([SENTENCE])  # warm-up
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        backend.encode([SENTENCE])
+    single = (time.perf_counter() - start) / QUERIES * 1000
+
+    start = time.perf_counter()
+    backend.encode([SENTENCE] * QUERIES, batch_size=64)
+    batched = (time.perf_counter() - start) / QUERIES * 1000
+
+    # ru_maxrss is reported in kilobytes on Linux.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{name:>10}: load {load_time:6.2f}s | single {single:6.2f} ms | "
+        f"batched {batched:6.2f} ms/sentence | peak RSS {rss:7.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+        sys.exit()
+
+    # Every backend runs in a fresh interpreter so load time and RSS are
+    # not skewed by modules imported for another backend.
+    for name in BACKENDS:
+        subprocess.run([sys.executable, __file__, name], check=True)
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+from sqlmodel import Session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.helpers import chunk_text, get_embedding_model, insert_chunks  # noqa
+from app.models import Chunk, Document, engine  # noqa
+
+WORDS = "retrieval augmented generation vector database embedding query".split()
+
+
+def synthetic_document(size_bytes: int) -> str:
+    words = []
+    length = 0
+    i = 0
+    while length < size_bytes:
+        word = f"{WORDS[i % len(WORDS)]}{i % 997}"
+        words.append(word)
+        length += len(word) + 1
+        i += 1
+    return " ".join(words)
+
+
+def ingest_per_chunk(session: Session, document: Document, chunks: list[str]):
+    model = get_embedding_model()
+    for chunk in chunks:
+        session.add(
+            Chunk(
+                document_id=document.id,
+                owner=document.owner,
+                chunk_text=chunk,
+                embedding=model.encode([chunk])[0].tolist(),
+            )
+        )
+    session.flush()
+
+
+def ingest_batched(session: Session, document: Document, chunks: list[str]):
+    insert_chunks(session, document.id, document.owner, chunks)
+
+
+def run(name: str, ingest, text: str):
+    chunks = chunk_text(text)
+    with Session(engine) as session:
+        document = Document(text=text, owner="Organization:benchmark")
+        session.add(document)
+        session.flush()
+
+        start = time.perf_counter()
+        ingest(session, document, chunks)
+        elapsed = time.perf_counter() - start
+
+        # Leave the database untouched.
+        session.rollback()
+
+    print(f"{name:>10}: {len(chunks)} chunks in {elapsed:.2f}s", end=" ")
+    print(f"({len(chunks) / elapsed:.1f} chunks/sec)")
+
+
+if __name__ == "__main__":
+    try:
+        size_mb = float(sys.argv[1])
+    except IndexError:
+        size_mb = 2
+
+    text = synthetic_document(int(size_mb * 1024 * 1024))
+    run("per-chunk", ingest_per_chunk, text)
+    run("batched", ingest_batched, text)
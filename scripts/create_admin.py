@@ -6,10 +6,12 @@ from sqlmodel import Session
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from app.helpers import get_password_hash, get_user_by_username  # noqa
-from app.models import Role, User, engine  # noqa
+from app.models import Role, User, engine, init_db  # noqa
 from app.oso import add_oso_role, delete_oso_user  # noqa
 
 if __name__ == "__main__":
+    init_db()
+
     try:
         password = sys.argv[1]
     except IndexError:
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+
+from sqlmodel import Session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.models import VECTOR_INDEX_TYPE, VECTOR_QUANTIZATION, engine  # noqa
+from app.vector_index import (  # noqa
+    INDEX_TYPES,
+    QUANTIZATIONS,
+    create_index,
+    create_owner_index,
+    drop_index,
+    drop_owner_index,
+    rebuild_index,
+    recommended_index_params,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the chunk embedding index.")
+    parser.add_argument("action", choices=["create", "rebuild", "drop"])
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--m", type=int, help="HNSW: connections per layer")
+    parser.add_argument("--ef-construction", type=int, help="HNSW: build list size")
+    parser.add_argument("--lists", type=int, help="IVFFlat: number of lists")
+    parser.add_argument("--maintenance-work-mem", help="e.g. 2GB")
+    parser.add_argument(
+        "--quantization", choices=QUANTIZATIONS, default=VECTOR_QUANTIZATION
+    )
+    parser.add_argument(
+        "--owner", help="partial index for one owner, e.g. Organization:acme"
+    )
+    args = parser.parse_args()
+
+    if args.action == "drop":
+        if args.owner:
+            drop_owner_index(engine, args.owner)
+        else:
+            drop_index(engine)
+        sys.exit()
+
+    with Session(engine) as session:
+        params = recommended_index_params(session, args.type)
+
+    for key in ("m", "ef_construction", "lists"):
+        if getattr(args, key) is not None and key in params:
+            params[key] = getattr(args, key)
+
+    print(f"{args.action} {args.type} ({args.quantization}) index with {params}")
+    if args.owner:
+        if args.action == "rebuild":
+            drop_owner_index(engine, args.owner)
+        create_owner_index(
+            engine,
+            args.owner,
+            args.type,
+            params,
+            args.maintenance_work_mem,
+            args.quantization,
+        )
+    else:
+        action = create_index if args.action == "create" else rebuild_index
+        action(engine, args.type, params, args.maintenance_work_mem, args.quantization)
@@ -7,10 +7,13 @@ from fastapi.testclient import TestClient
 from oso_cloud import Oso
 from psycopg2 import connect
 from psycopg2.errors import DuplicateDatabase
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import oso
-from app.dependencies import get_session
+from app.dependencies import get_async_session, get_session, user_cache
 from app.helpers import create_access_token, get_password_hash
 from app.main import app
 from app.models import Role, User
@@ -68,7 +71,21 @@ def client_fixture(session: Session):
     def get_session_override():
         return session
 
+    # TestClient runs every request on its own event loop, so connections
+    # must not be pooled across requests.
+    async_engine = create_async_engine(
+        f"postgresql+asyncpg://{USER}:{PASSWORD}@{HOST}:{PORT}/{TEST_DB}",
+        poolclass=NullPool,
+    )
+
+    async def get_async_session_override():
+        async with AsyncSession(async_engine) as async_session:
+            yield async_session
+
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    # Users are recreated with the same usernames by every test.
+    user_cache.clear()
 
     client = TestClient(app)
     yield client
@@ -146,3 +163,4 @@ def initialize_oso_client():
     data = response.json()
     dev_oso = Oso(url=dev_server_url, api_key=data["token"])
     oso.oso = dev_oso
+    oso.decision_cache.clear()
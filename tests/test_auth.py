@@ -1,11 +1,32 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+
 import jwt
+import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
+from passlib.context import CryptContext
 from sqlmodel import Session
 
-from app.helpers import ALGORITHM, SECRET_KEY, get_user_by_id
+from app.dependencies import get_current_user
+from app.helpers import (
+    ALGORITHM,
+    SECRET_KEY,
+    create_access_token,
+    get_user_by_id,
+    verify_password,
+)
 from app.models import Role, User
 from app.oso import get_oso_role
+from app.passwords import (
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    hash_password,
+    map_hashing,
+    run_hashing,
+)
 
 
 def test_login_for_access_token(client: TestClient, test_user: User):
@@ -18,6 +39,7 @@ def test_login_for_access_token(client: TestClient, test_user: User):
 
     payload = jwt.decode(data["access_token"], SECRET_KEY, algorithms=[ALGORITHM])
     assert test_user.username == payload.get("sub")
+    assert str(test_user.id) == payload.get("uid")
 
 
 def test_post_register(client: TestClient, test_user_data: dict, session: Session):
@@ -49,3 +71,96 @@ def test_post_register_cannot_set_admin_role(
 
     user = get_user_by_id(session, data["id"])
     assert Role.USER == get_oso_role(user)
+
+
+def test_claims_only_identity(client: TestClient):
+    token = create_access_token(
+        data={"sub": "nobody", "uid": "00000000-0000-0000-0000-000000000000"}
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    job = "/rag/jobs/00000000-0000-0000-0000-000000000000/"
+
+    response = client.get(job, headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    with patch("app.dependencies.AUTH_CLAIMS_ONLY", True):
+        response = client.get(job, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_get_current_user_cached_copy_keeps_role(
+    session: Session, test_admin: User, admin_token: str
+):
+    first = get_current_user(admin_token, session)
+    second = get_current_user(admin_token, session)
+
+    assert first.role == second.role == Role.ADMIN
+    assert second is not first
+    assert second not in session
+
+
+def test_login_rehashes_outdated_password(
+    client: TestClient, test_user_data: dict, session: Session
+):
+    outdated = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS - 1)
+    user = User(
+        username=test_user_data["username"],
+        email=test_user_data["email"],
+        password=outdated.hash(test_user_data["password"]),
+    )
+    session.add(user)
+    session.commit()
+
+    response = client.post(
+        "/auth/login/",
+        data={
+            "username": test_user_data["username"],
+            "password": test_user_data["password"],
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    session.refresh(user)
+    assert user.password.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+    assert verify_password(test_user_data["password"], user.password)
+
+
+def test_login_rejected_when_hashing_is_saturated(client: TestClient, test_user: User):
+    with patch("app.passwords._slots", threading.BoundedSemaphore(0)):
+        response = client.post(
+            "/auth/login/", data={"username": "testuser", "password": "password123"}
+        )
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test_map_hashing_submits_one_wave_per_worker():
+    outstanding = []
+    peak = 0
+
+    class LazyFuture:
+        def __init__(self, func, value):
+            self.func, self.value = func, value
+
+        def result(self):
+            outstanding.remove(self)
+            return self.func(self.value)
+
+    class Executor:
+        def submit(self, func, value):
+            nonlocal peak
+            outstanding.append(LazyFuture(func, value))
+            peak = max(peak, len(outstanding))
+            return outstanding[-1]
+
+    values = [f"v{i}" for i in range(PASSWORD_HASH_WORKERS * 3 + 1)]
+    with patch("app.passwords.get_hashing_executor", return_value=Executor()):
+        assert map_hashing(str.upper, values) == [v.upper() for v in values]
+    assert peak == PASSWORD_HASH_WORKERS
+
+
+def test_run_hashing_replaces_a_broken_pool():
+    # A worker exiting mid-call breaks the pool, as an OOM kill would.
+    with pytest.raises(BrokenProcessPool):
+        run_hashing(os._exit, 1)
+
+    assert run_hashing(hash_password, "password123").startswith("$2b$")
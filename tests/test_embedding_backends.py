@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from app.embedding_backends import get_embedding_backend
+
+SENTENCES = [
+    "What is the document about?",
+    "Error code E1234 occurs when the database connection times out.",
+    "Retrieval-augmented generation combines search with a language model.",
+    "The quick brown fox jumps over the lazy dog. " * 40,
+]
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.fixture(scope="module")
+def torch_embeddings():
+    return get_embedding_backend("torch").encode(SENTENCES)
+
+
+@pytest.mark.parametrize("name, min_similarity", [("onnx", 0.999), ("onnx-int8", 0.97)])
+def test_backend_parity_with_torch(name, min_similarity, torch_embeddings):
+    embeddings = get_embedding_backend(name).encode(SENTENCES, batch_size=2)
+    assert embeddings.shape == torch_embeddings.shape
+    assert cosine(embeddings, torch_embeddings).min() >= min_similarity
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_embedding_backend("tensorflow")
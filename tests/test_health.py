@@ -0,0 +1,20 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def test_get_live(client: TestClient):
+    response = client.get("/health/live/")
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_get_ready(client: TestClient):
+    app.state.ready = False
+    response = client.get("/health/ready/")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    app.state.ready = True
+    response = client.get("/health/ready/")
+    assert response.status_code == status.HTTP_200_OK
+    app.state.ready = False
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app import helpers
+from app.helpers import EmbeddingBatcher, LRUCache, chunk_text, create_embedding
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_create_embedding_is_cached():
+    helpers.embedding_cache.clear()
+    model = helpers.get_embedding_model()
+    with patch.object(model, "encode", wraps=model.encode) as encode:
+        first = create_embedding("What is  the document about?")
+        second = create_embedding(" What is the document about? ")
+
+    assert first == second
+    assert encode.call_count == 1
+    assert helpers.embedding_cache.stats()["hits"] == 1
+
+
+def test_embedding_batcher_coalesces_concurrent_requests():
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(encode, max_size=8, max_wait_ms=50)
+    texts = ["a", "bb", "ccc", "a"]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(batcher.embed, texts))
+
+    assert results == [[1.0], [2.0], [3.0], [1.0]]
+    assert sum(len(batch) for batch in calls) <= 3
+    assert batcher.stats()["items"] == 4
+    assert batcher.stats()["max_batch_size"] >= 2
+
+
+def test_embedding_batcher_submit_batches_awaited_requests():
+    batcher = EmbeddingBatcher(
+        lambda texts: [[float(len(text))] for text in texts],
+        max_size=64,
+        max_wait_ms=50,
+    )
+
+    async def embed_all(texts):
+        futures = [asyncio.wrap_future(batcher.submit(text)) for text in texts]
+        return await asyncio.gather(*futures)
+
+    texts = [str(i) for i in range(32)]
+    results = asyncio.run(embed_all(texts))
+
+    assert results == [[float(len(text))] for text in texts]
+    assert batcher.stats()["max_batch_size"] > 8
+
+
+def test_embedding_batcher_survives_cancelled_callers():
+    started = threading.Event()
+    release = threading.Event()
+
+    def encode(texts):
+        started.set()
+        release.wait(5)
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(encode, max_size=8, max_wait_ms=1)
+
+    async def cancel_waiters():
+        busy = asyncio.wrap_future(batcher.submit("busy"))
+        await asyncio.to_thread(started.wait, 5)
+        # Queued behind the running batch, then cancelled before it is taken.
+        waiter = asyncio.wrap_future(batcher.submit("cancelled"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(waiter, 0.01)
+        # Cancelled while its batch is being encoded.
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(busy, 0.01)
+        release.set()
+
+    asyncio.run(cancel_waiters())
+
+    assert batcher.submit("after").result(timeout=5) == [5.0]
+
+
+def test_encode_texts_in_process_pool():
+    texts = [f"sentence number {i}" for i in range(10)]
+    expected = helpers.encode_texts(texts, batch_size=4)
+
+    with patch.object(helpers, "EMBEDDING_PROCESSES", 2):
+        try:
+            embeddings = helpers.encode_texts(texts, batch_size=4)
+        finally:
+            helpers.shutdown_embedding_process_pool()
+            helpers._embedding_process_pool = None
+
+    assert embeddings.dtype == np.float32
+    assert np.allclose(embeddings, expected, atol=1e-5)
+
+
+def test_encode_texts_replaces_a_broken_process_pool():
+    texts = [f"sentence number {i}" for i in range(10)]
+    expected = helpers.encode_texts(texts, batch_size=4)
+
+    with patch.object(helpers, "EMBEDDING_PROCESSES", 2):
+        try:
+            helpers.encode_texts(texts, batch_size=4)
+            # A killed worker, e.g. by the OOM killer, breaks the whole pool.
+            pool = helpers.get_embedding_process_pool()
+            os.kill(next(iter(pool._processes)), signal.SIGKILL)
+            embeddings = helpers.encode_texts(texts, batch_size=4)
+        finally:
+            helpers.shutdown_embedding_process_pool()
+            helpers._embedding_process_pool = None
+
+    assert np.allclose(embeddings, expected, atol=1e-5)
+
+
+def test_chunk_text_respects_token_budget_and_overlap():
+    text = " ".join(f"identifier_{i} appears here." for i in range(300))
+    chunks = chunk_text(text, max_tokens=64, overlap=8)
+    tokenizer = helpers.get_chunk_tokenizer()
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        tokens = tokenizer.encode(chunk, add_special_tokens=False).tokens
+        assert len(tokens) <= 64
+
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous.split()[-1] == current.split()[0]
+
+    without_overlap = chunk_text(text, max_tokens=64, overlap=0)
+    assert " ".join(without_overlap) == text
+    assert chunk_text("") == []
+
+
+def test_chunk_text_splits_text_without_whitespace():
+    text = "".join(f"{i}," for i in range(20000))
+    start = time.perf_counter()
+    chunks = chunk_text(text, max_tokens=64, overlap=0)
+    assert time.perf_counter() - start < 10
+    tokenizer = helpers.get_chunk_tokenizer()
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(tokenizer.encode(chunk, add_special_tokens=False).tokens) <= 64
+    assert "".join(chunks) == text
+
+
+def test_chunk_text_merges_short_paragraphs():
+    paragraphs = [f"Question {i}? Answer number {i} is short." for i in range(200)]
+    text = "\n\n".join(paragraphs)
+    chunks = chunk_text(text)
+    tokenizer = helpers.get_chunk_tokenizer()
+
+    assert len(chunks) < len(paragraphs) / 2
+    for chunk in chunks:
+        tokens = tokenizer.encode(chunk, add_special_tokens=False).tokens
+        assert len(tokens) <= helpers.CHUNK_MAX_TOKENS
+    pieces = [text[i : i + 100] for i in range(0, len(text), 100)]  # noqa
+    assert list(helpers.iter_chunks(pieces)) == chunks
+
+    # Boundaries are picked by content, so an early edit stays local.
+    edited = chunk_text(text.replace("Answer number 1 ", "Answer number one ", 1))
+    assert len(set(edited) - set(chunks)) <= 3
+
+
+def test_chunker_bounds_words_without_whitespace():
+    text = "".join(f"{i}," for i in range(20000))
+    chunker = helpers.Chunker(max_tokens=64, overlap=0)
+    chunks = []
+    for i in range(0, len(text), 1000):
+        chunks += chunker.feed(text[i : i + 1000])  # noqa
+        assert len(chunker._partial) <= chunker.max_partial_chars + 1000
+    chunks += chunker.close()
+
+    assert chunks == chunk_text(text, max_tokens=64, overlap=0)
@@ -0,0 +1,43 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+
+
+def test_get_metrics(client: TestClient, admin_token: str):
+    response = client.get(
+        "/metrics/", headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert "hit_rate" in data["embedding_cache"]
+    assert "avg_batch_size" in data["embedding_batcher"]
+
+
+def test_get_metrics_with_less_privilege(client: TestClient, user_token: str):
+    response = client.get(
+        "/metrics/", headers={"Authorization": f"Bearer {user_token}"}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.get("/metrics/")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_get_metrics_oso_decision_cache(client: TestClient, admin_token: str):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    client.get("/metrics/", headers=headers)
+    response = client.get("/metrics/", headers=headers)
+
+    stats = response.json()["oso_decision_cache"]
+    assert stats["hits"] >= 1
+    assert stats["size"] >= 1
+
+
+def test_get_metrics_db_pools(client: TestClient, admin_token: str):
+    response = client.get(
+        "/metrics/", headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    data = response.json()
+    for pool in ("db_pool", "async_db_pool"):
+        assert 0 <= data[pool]["saturation"] <= 1
+        assert "wait_max_ms" in data[pool]
+        assert "timeouts" in data[pool]
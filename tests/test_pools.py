@@ -0,0 +1,26 @@
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from app.pools import pool_stats, timed_pool_class
+
+
+def test_timed_pool_records_checkouts_and_timeouts():
+    pool = timed_pool_class(QueuePool)(
+        MagicMock, pool_size=1, max_overflow=0, timeout=0.01
+    )
+
+    connection = pool.connect()
+    stats = pool_stats(pool)
+    assert stats["checkouts"] == 1
+    assert stats["saturation"] == 1
+
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    assert pool_stats(pool)["timeouts"] == 1
+    assert pool_stats(pool)["wait_max_ms"] >= 10
+
+    connection.close()
+    assert pool_stats(pool)["saturation"] == 0
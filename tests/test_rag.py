@@ -1,10 +1,23 @@
-from unittest.mock import MagicMock, patch
+import json
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from fastapi import status
 from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
-from app.models import Chunk
+from app.answer_cache import bump_corpus_version
+from app.dependencies import get_async_session
+from app.helpers import (
+    chunk_text,
+    content_hash,
+    embed_chunk_rows,
+    insert_chunk_rows,
+)
+from app.ingestion import fail_unfinished_jobs
+from app.main import app
+from app.models import Chunk, ChunkEmbedding, Document, IngestionJob, JobStatus
 
 
 def test_post_upload_text(
@@ -26,6 +39,178 @@ def test_post_upload_text(
     assert chunks[0].chunk_text == sample_text
 
 
+def test_post_upload_text_multiple_chunks(
+    client: TestClient, session: Session, user_token: str
+):
+    text = " ".join(f"word{i}" for i in range(600))
+    response = client.post(
+        "/rag/upload/",
+        json={"text": text},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+
+    chunks = session.exec(
+        select(Chunk).where(Chunk.document_id == data["document_id"])
+    ).all()
+    assert len(chunks) == len(chunk_text(text)) > 1
+    assert {chunk.chunk_text for chunk in chunks} == set(chunk_text(text))
+    assert all(len(chunk.embedding) == 384 for chunk in chunks)
+
+
+def test_post_upload_text_async(
+    client: TestClient, sample_text, session: Session, user_token: str
+):
+    response = client.post(
+        "/rag/upload/async/",
+        json={"text": sample_text},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+
+    chunks = session.exec(
+        select(Chunk).where(Chunk.document_id == data["document_id"])
+    ).all()
+    assert len(chunks) == 1
+    assert chunks[0].chunk_text == sample_text
+
+
+def test_post_upload_stream_files(
+    client: TestClient, sample_text, session: Session, user_token: str
+):
+    long_text = " ".join(f"word{i}" for i in range(600))
+    response = client.post(
+        "/rag/upload/stream/",
+        files=[
+            ("files", ("sample.txt", sample_text.encode(), "text/plain")),
+            ("files", ("long.txt", long_text.encode(), "text/plain")),
+        ],
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    documents = response.json()["documents"]
+    assert [d["name"] for d in documents] == ["sample.txt", "long.txt"]
+    assert documents[0]["chunks"] == 1
+    assert documents[1]["chunks"] == len(chunk_text(long_text))
+
+    chunks = session.exec(
+        select(Chunk).where(Chunk.document_id == documents[1]["document_id"])
+    ).all()
+    assert {chunk.chunk_text for chunk in chunks} == set(chunk_text(long_text))
+
+
+def test_post_upload_stream_rejects_truncated_multipart(
+    client: TestClient, session: Session, user_token: str
+):
+    body = (
+        b"--xyz\r\n"
+        b'Content-Disposition: form-data; name="files"; filename="cut.txt"\r\n'
+        b"Content-Type: text/plain\r\n\r\n"
+    ) + " ".join(f"word{i}" for i in range(600)).encode()
+    response = client.post(
+        "/rag/upload/stream/",
+        content=body,
+        headers={
+            "Authorization": f"Bearer {user_token}",
+            "Content-Type": "multipart/form-data; boundary=xyz",
+        },
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert session.exec(select(Document)).all() == []
+
+
+def test_post_upload_stream_plain_text(
+    client: TestClient, sample_text, session: Session, user_token: str
+):
+    response = client.post(
+        "/rag/upload/stream/",
+        content=sample_text.encode(),
+        headers={
+            "Authorization": f"Bearer {user_token}",
+            "Content-Type": "text/plain",
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    document = response.json()["documents"][0]
+
+    chunks = session.exec(
+        select(Chunk).where(Chunk.document_id == document["document_id"])
+    ).all()
+    assert [chunk.chunk_text for chunk in chunks] == [sample_text]
+
+
+def test_post_upload_text_in_background(
+    client: TestClient, session: Session, user_token: str
+):
+    text = " ".join(f"word{i}" for i in range(600))
+    headers = {"Authorization": f"Bearer {user_token}"}
+    release = threading.Event()
+
+    def bump_corpus_version_later(session: Session):
+        release.wait(10)
+        bump_corpus_version(session)
+
+    # The job holds before its commit, so it can be polled while running.
+    with patch("app.ingestion.bump_corpus_version", bump_corpus_version_later):
+        response = client.post(
+            "/rag/upload/?background=true", json={"text": text}, headers=headers
+        )
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        data = response.json()
+
+        for _ in range(100):
+            job = client.get(f"/rag/jobs/{data['job_id']}/", headers=headers).json()
+            if job["chunks_done"] == job["chunks_total"] > 0:
+                break
+            time.sleep(0.1)
+
+        assert job["status"] == JobStatus.RUNNING
+        assert job["chunks_total"] == len(chunk_text(text))
+        release.set()
+
+    for _ in range(100):
+        job = client.get(f"/rag/jobs/{data['job_id']}/", headers=headers).json()
+        if job["status"] in (JobStatus.DONE, JobStatus.FAILED):
+            break
+        time.sleep(0.1)
+
+    assert job["status"] == JobStatus.DONE
+    assert job["chunks_total"] == job["chunks_done"] == len(chunk_text(text))
+    assert job["finished_at"] is not None
+
+    chunks = session.exec(
+        select(Chunk).where(Chunk.document_id == data["document_id"])
+    ).all()
+    assert len(chunks) == job["chunks_total"]
+
+
+def test_fail_unfinished_jobs(session: Session):
+    document = Document(text="text")
+    pending = IngestionJob(document_id=document.id)
+    done = IngestionJob(document_id=document.id, status=JobStatus.DONE)
+    session.add_all([document, pending, done])
+    session.commit()
+
+    assert fail_unfinished_jobs(session.get_bind(), "Cancelled") == 1
+
+    session.refresh(pending)
+    session.refresh(done)
+    assert pending.status == JobStatus.FAILED
+    assert pending.error == "Cancelled"
+    assert pending.finished_at is not None
+    assert done.status == JobStatus.DONE
+
+
+def test_get_job_not_found(client: TestClient, user_token: str):
+    response = client.get(
+        "/rag/jobs/00000000-0000-0000-0000-000000000000/",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 @patch("openai.chat.completions.create")
 def test_post_query_text(mock_openai, client: TestClient, user_token: str):
     mock_openai.return_value = MagicMock()
@@ -43,3 +228,381 @@ def test_post_query_text(mock_openai, client: TestClient, user_token: str):
     assert "answer" in data
     assert data["answer"] == "This is a mocked response from OpenAI."
     assert "context" in data
+
+
+@patch("app.routers.rag.get_async_client")
+def test_post_query_text_async(mock_client, client: TestClient, user_token: str):
+    mock_openai = mock_client.return_value.chat.completions.create = AsyncMock()
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [
+        MagicMock(message=MagicMock(content="This is a mocked response from OpenAI."))
+    ]
+
+    response = client.post(
+        "/rag/query/async/",
+        json={"text": "What is the document about?"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["answer"] == "This is a mocked response from OpenAI."
+    assert "context" in data
+
+
+@patch("app.routers.rag.get_async_client")
+def test_post_query_text_async_releases_connection_during_llm_call(
+    mock_client, client: TestClient, user_token: str
+):
+    sessions = []
+    override = app.dependency_overrides[get_async_session]
+
+    async def get_async_session_override():
+        async for async_session in override():
+            sessions.append(async_session)
+            yield async_session
+
+    async def create(**kwargs):
+        assert not sessions[0].in_transaction()
+        return MagicMock(choices=[MagicMock(message=MagicMock(content="ok"))])
+
+    mock_client.return_value.chat.completions.create = create
+    app.dependency_overrides[get_async_session] = get_async_session_override
+
+    response = client.post(
+        "/rag/query/async/",
+        json={"text": "What is the document about?"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["answer"] == "ok"
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_with_search_params(
+    mock_openai, client: TestClient, user_token: str
+):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+
+    response = client.post(
+        "/rag/query/",
+        json={"text": "What is the document about?", "ef_search": 100, "probes": 5},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.post(
+        "/rag/query/",
+        json={"text": "What is the document about?", "ef_search": 0},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_uses_answer_cache(
+    mock_openai, client: TestClient, sample_text, user_token: str
+):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    response = client.post(
+        "/rag/query/", json={"text": "What is the document about?"}, headers=headers
+    )
+    assert response.json()["cached"] is False
+
+    response = client.post(
+        "/rag/query/", json={"text": "What is the document about?"}, headers=headers
+    )
+    assert response.json()["cached"] is True
+    assert response.json()["answer"] == "ok"
+    assert mock_openai.call_count == 1
+
+    # A new upload invalidates every cached answer.
+    client.post("/rag/upload/", json={"text": sample_text}, headers=headers)
+    response = client.post(
+        "/rag/query/", json={"text": "What is the document about?"}, headers=headers
+    )
+    assert response.json()["cached"] is False
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_answer_cache_matches_retrieval_params(
+    mock_openai, client: TestClient, user_token: str
+):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+    headers = {"Authorization": f"Bearer {user_token}"}
+    question = "What is the document about?"
+
+    client.post("/rag/query/", json={"text": question}, headers=headers)
+    for params in ({"max_distance": 0.2}, {"top_k": 5}, {"mode": "hybrid"}):
+        response = client.post(
+            "/rag/query/", json={"text": question, **params}, headers=headers
+        )
+        assert response.json()["cached"] is False
+
+    response = client.post(
+        "/rag/query/", json={"text": question, "top_k": 5}, headers=headers
+    )
+    assert response.json()["cached"] is True
+    assert mock_openai.call_count == 2
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_stream(mock_openai, client: TestClient, user_token: str):
+    mock_openai.return_value = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=token))])
+        for token in ["This is ", "a streamed ", "response."]
+    ]
+
+    response = client.post(
+        "/rag/query/stream/",
+        json={"text": "What is the document about?"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [
+        (lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: ")))
+        for lines in (
+            block.split("\n") for block in response.text.strip().split("\n\n")
+        )
+    ]
+    assert events[0] == ("context", [])
+    assert events[1] == ("sources", [])
+    assert [data for event, data in events if event == "token"] == [
+        "This is ",
+        "a streamed ",
+        "response.",
+    ]
+    assert events[-1] == ("done", {"cached": False})
+    assert mock_openai.call_args.kwargs["stream"] is True
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_hybrid(mock_openai, client: TestClient, user_token: str):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    client.post(
+        "/rag/upload/",
+        json={"text": "Error E1234 means the disk quota was exceeded."},
+        headers=headers,
+    )
+    response = client.post(
+        "/rag/query/",
+        json={"text": "What does E1234 mean?", "mode": "hybrid"},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert (
+        "Error E1234 means the disk quota was exceeded." in response.json()["context"]
+    )
+
+    response = client.post(
+        "/rag/query/", json={"text": "E1234", "mode": "keyword"}, headers=headers
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_top_k_and_max_distance(
+    mock_openai, client: TestClient, user_token: str
+):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    for text in ["Cats purr.", "Dogs bark.", "Cows moo."]:
+        client.post("/rag/upload/", json={"text": text}, headers=headers)
+
+    response = client.post(
+        "/rag/query/", json={"text": "Which animal purrs?", "top_k": 2}, headers=headers
+    )
+    data = response.json()
+    assert len(data["context"]) == len(data["sources"]) == 2
+    assert data["context"][0] == "Cats purr."
+    distances = [source["distance"] for source in data["sources"]]
+    assert distances == sorted(distances)
+
+    response = client.post(
+        "/rag/query/",
+        json={"text": "How do you bake bread?", "max_distance": 0.01},
+        headers=headers,
+    )
+    assert response.json()["context"] == []
+
+
+def test_post_upload_text_reuses_cached_embeddings(
+    client: TestClient, session: Session, user_token: str
+):
+    text = " ".join(f"clause{i}" for i in range(600))
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    first = client.post("/rag/upload/", json={"text": text}, headers=headers).json()
+    assert first["chunks"] == len(chunk_text(text))
+    assert first["cache_hit_ratio"] == 0.0
+
+    with patch("app.helpers.get_embedding_model") as get_embedding_model:
+        second = client.post("/rag/upload/", json={"text": text}, headers=headers)
+    assert second.json()["cache_hits"] == first["chunks"]
+    assert second.json()["cache_hit_ratio"] == 1.0
+    assert not get_embedding_model.return_value.encode.called
+
+    embeddings = session.exec(
+        select(Chunk.document_id, Chunk.embedding).order_by(Chunk.chunk_text)
+    ).all()
+    by_document = {}
+    for document_id, embedding in embeddings:
+        by_document.setdefault(document_id, []).append(embedding.tolist())
+    assert len(by_document) == 2
+    first_embeddings, second_embeddings = by_document.values()
+    assert first_embeddings == second_embeddings
+
+
+def test_chunk_embedding_cache_commits_apart_from_chunks(session: Session):
+    document = Document(text="b chunk a chunk")
+    session.add(document)
+    session.flush()
+
+    rows = embed_chunk_rows(document.id, document.owner, ["b chunk", "a chunk"])
+    insert_chunk_rows(session, rows)
+
+    with Session(session.get_bind()) as other:
+        cached = other.exec(select(ChunkEmbedding.content_hash)).all()
+    assert set(cached) == {content_hash("b chunk"), content_hash("a chunk")}
+    session.rollback()
+
+
+def test_put_document_reindexes_changed_chunks(
+    client: TestClient, session: Session, user_token: str
+):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    text = " ".join(f"word{i}" for i in range(1000))
+    document_id = client.post(
+        "/rag/upload/", json={"text": text}, headers=headers
+    ).json()["document_id"]
+    unchanged = {
+        chunk.id: chunk.chunk_text
+        for chunk in session.exec(select(Chunk).where(Chunk.document_id == document_id))
+    }
+
+    new_text = text.replace("word999", "changed")
+    response = client.put(
+        f"/rag/documents/{document_id}/", json={"text": new_text}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["added"] == data["removed"] == 1
+    assert data["unchanged"] == len(chunk_text(new_text)) - 1
+
+    session.expire_all()
+    chunks = session.exec(select(Chunk).where(Chunk.document_id == document_id)).all()
+    assert sorted(chunk.chunk_text for chunk in chunks) == sorted(chunk_text(new_text))
+    kept = [chunk for chunk in chunks if chunk.id in unchanged]
+    assert len(kept) == data["unchanged"]
+
+
+def test_put_document_edit_near_start_keeps_later_chunks(
+    client: TestClient, user_token: str
+):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    paragraphs = [
+        " ".join(f"word{i}" for i in range(p * 200, p * 200 + 200)) for p in range(20)
+    ]
+    text = "\n\n".join(paragraphs)
+    document_id = client.post(
+        "/rag/upload/", json={"text": text}, headers=headers
+    ).json()["document_id"]
+
+    new_text = text.replace("word3 ", "a few more words ", 1)
+    response = client.put(
+        f"/rag/documents/{document_id}/", json={"text": new_text}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["chunks"] > 20
+    # Only the chunks of the edited paragraph change.
+    first_paragraph = len(chunk_text(paragraphs[0]))
+    assert data["removed"] <= first_paragraph
+    assert data["added"] <= first_paragraph + 1
+    assert data["unchanged"] >= data["chunks"] - first_paragraph - 1
+
+
+def test_put_document_not_found(client: TestClient, user_token: str):
+    response = client.put(
+        "/rag/documents/00000000-0000-0000-0000-000000000000/",
+        json={"text": "text"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@patch("openai.chat.completions.create")
+def test_post_query_text_scoped_to_owner(
+    mock_openai, client: TestClient, user_token: str, admin_token: str
+):
+    mock_openai.return_value = MagicMock()
+    mock_openai.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+    user_headers = {"Authorization": f"Bearer {user_token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    client.post(
+        "/rag/upload/", json={"text": "The user's private notes."}, headers=user_headers
+    )
+    client.post(
+        "/rag/upload/?shared=true",
+        json={"text": "The organization handbook."},
+        headers=admin_headers,
+    )
+
+    response = client.post(
+        "/rag/query/", json={"text": "notes", "top_k": 10}, headers=user_headers
+    )
+    assert set(response.json()["context"]) == {
+        "The user's private notes.",
+        "The organization handbook.",
+    }
+
+    response = client.post(
+        "/rag/query/", json={"text": "notes", "top_k": 10}, headers=admin_headers
+    )
+    assert response.json()["context"] == ["The organization handbook."]
+
+
+def test_shared_documents_require_organization_edit(
+    client: TestClient, user_token: str, admin_token: str
+):
+    user_headers = {"Authorization": f"Bearer {user_token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    for path in ("/rag/upload/?shared=true", "/rag/upload/async/?shared=true"):
+        response = client.post(
+            path, json={"text": "Not the handbook."}, headers=user_headers
+        )
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.post(
+        "/rag/upload/?shared=true",
+        json={"text": "The organization handbook."},
+        headers=admin_headers,
+    )
+    document_id = response.json()["document_id"]
+
+    response = client.put(
+        f"/rag/documents/{document_id}/",
+        json={"text": "Rewritten by a plain user."},
+        headers=user_headers,
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.put(
+        f"/rag/documents/{document_id}/",
+        json={"text": "The revised organization handbook."},
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
@@ -0,0 +1,64 @@
+import uuid
+
+import pytest
+from sqlalchemy import event, text
+from sqlmodel import Session
+
+from app.models import Chunk, Document
+from app.retrieval import vector_search
+from app.vector_index import set_search_params
+
+
+@pytest.mark.parametrize("quantization", ["halfvec", "bit"])
+def test_vector_search_reranks_quantized_candidates(
+    session: Session, quantization: str
+):
+    document = Document(text="", owner="User:test")
+    session.add(document)
+    for i in range(5):
+        embedding = [0.0] * 384
+        embedding[0] = 1.0
+        embedding[1 + i] = 0.1 * (i + 1)
+        session.add(
+            Chunk(
+                id=uuid.uuid4(),
+                document_id=document.id,
+                owner=document.owner,
+                chunk_text=f"chunk {i}",
+                embedding=embedding,
+            )
+        )
+    session.commit()
+
+    query = [0.0] * 384
+    query[0] = 1.0
+    exact = vector_search(session, query, top_k=3, quantization="none")
+    rows = vector_search(session, query, top_k=3, quantization=quantization)
+
+    assert [row.chunk_text for row in rows] == ["chunk 0", "chunk 1", "chunk 2"]
+    assert [row.distance for row in rows] == pytest.approx(
+        [row.distance for row in exact]
+    )
+
+
+def test_set_search_params_in_one_round_trip(session: Session):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        set_search_params(session, ef_search=123, probes=7)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+
+    settings = session.exec(
+        text(
+            "SELECT current_setting('hnsw.ef_search'),"
+            " current_setting('ivfflat.probes')"
+        )
+    ).one()
+    assert tuple(settings) == ("123", "7")
@@ -1,10 +1,11 @@
+import json
 import uuid
 
 from fastapi import status
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
-from app.helpers import get_user_by_id, verify_password
+from app.helpers import get_password_hash, get_user_by_id, verify_password
 from app.models import Role, User
 from app.oso import get_oso_role
 
@@ -27,6 +28,34 @@ def test_get_users_with_admin_role(
     assert {x.username for x in test_users} == {x["username"] for x in data}
 
 
+def test_get_users_paginated(
+    client: TestClient, test_users: list[User], admin_token: str
+):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = client.get("/users/?order_by=username&limit=1", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert [x["username"] for x in response.json()] == ["testadmin"]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(
+        f"/users/?order_by=username&limit=1&after={cursor}", headers=headers
+    )
+    assert [x["username"] for x in response.json()] == ["testuser"]
+
+    response = client.get("/users/?after=not-a-uuid", headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_export_users(client: TestClient, test_users: list[User], admin_token: str):
+    response = client.get(
+        "/users/export/", headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert {x.username for x in test_users} == {x["username"] for x in lines}
+
+
 def test_get_users_with_less_privilege(client: TestClient):
     response = client.get("/users/")
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -88,6 +117,67 @@ def test_post_user_with_same_data(
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
 
+def test_post_users_import(
+    client: TestClient, test_user: User, admin_token: str, session: Session
+):
+    rows = [
+        {"username": "bulk1", "email": "bulk1@example.com", "password": "pw1"},
+        {
+            "username": "bulk2",
+            "email": "bulk2@example.com",
+            "password_hash": get_password_hash("pw2"),
+            "role": Role.ADMIN,
+        },
+        {"username": test_user.username, "email": "new@example.com", "password": "x"},
+        {"username": "bulk3", "email": "bulk1@example.com", "password": "pw3"},
+        {"username": "bulk4", "email": "bulk4@example.com"},
+    ]
+    response = client.post(
+        "/users/import/",
+        json=rows,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["created"] == 2
+    assert data["failed"] == 3
+    assert [r["status"] for r in data["results"]] == [
+        "created",
+        "created",
+        "failed",
+        "failed",
+        "failed",
+    ]
+    assert data["results"][2]["detail"] == "username already exists"
+    assert data["results"][3]["detail"] == "email already exists"
+
+    user = get_user_by_id(session, uuid.UUID(data["results"][1]["id"]))
+    assert verify_password("pw2", user.password)
+    assert Role.ADMIN == get_oso_role(user)
+
+
+def test_post_users_import_csv(client: TestClient, admin_token: str):
+    response = client.post(
+        "/users/import/",
+        content="username,email,password,role\nbulk1,bulk1@example.com,pw1,\n",
+        headers={
+            "Authorization": f"Bearer {admin_token}",
+            "Content-Type": "text/csv",
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["created"] == 1
+
+
+def test_post_users_import_with_less_privilege(client: TestClient, user_token: str):
+    response = client.post(
+        "/users/import/",
+        json=[],
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
 def test_get_me(client: TestClient, test_user: User, user_token: str):
     response = client.get(
         "/users/me/", headers={"Authorization": f"Bearer {user_token}"}
@@ -211,6 +301,17 @@ def test_delete_user_owner(client: TestClient, test_user: User, user_token: str)
     assert response.status_code == status.HTTP_200_OK
 
 
+def test_delete_user_invalidates_cached_user(
+    client: TestClient, test_user: User, user_token: str
+):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    assert client.get("/users/me/", headers=headers).status_code == status.HTTP_200_OK
+
+    client.delete(f"/users/{test_user.id}/", headers=headers)
+    response = client.get("/users/me/", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
 def test_delete_user_with_less_privilege(
     client: TestClient, test_admin: User, user_token: str
 ):
@@ -236,6 +337,22 @@ def test_patch_user_role(client: TestClient, test_user: User, admin_token: str):
     assert Role.ADMIN == get_oso_role(test_user)
 
 
+def test_patch_user_role_invalidates_cached_decisions(
+    client: TestClient, test_user: User, user_token: str, admin_token: str
+):
+    user_headers = {"Authorization": f"Bearer {user_token}"}
+    response = client.get("/metrics/", headers=user_headers)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    client.patch(
+        f"/users/{test_user.id}/role/",
+        json={"role": Role.ADMIN},
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    response = client.get("/metrics/", headers=user_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+
 def test_patch_user_role_with_less_privilege(
     client: TestClient, test_user: User, user_token: str
 ):